@@ -1,8 +1,33 @@
 import asyncio
+import sys
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime
 from config import settings
 
+BATCH_SIZE = 500
+
+# Only the fields printed below; keeps base64 images and CSV payloads off the wire
+CONVERSATION_PROJECTION = {"title": 1, "created_at": 1, "updated_at": 1, "message_count": 1}
+MESSAGE_PROJECTION = {
+    "conversation_id": 1,
+    "role": 1,
+    "timestamp": 1,
+    "content.type": 1,
+    "content.text": 1,
+    "content.csv_data.basic_info": 1
+}
+
+
+async def iter_batches(cursor, batch_size: int = BATCH_SIZE):
+    """Yield lists of documents pulled from the cursor batch_size at a time"""
+    cursor = cursor.batch_size(batch_size)
+    while True:
+        batch = await cursor.to_list(length=batch_size)
+        if not batch:
+            break
+        yield batch
+
+
 async def check_database():
     # Connect to MongoDB using settings from .env
     client = AsyncIOMotorClient(settings.mongodb_url)
@@ -14,50 +39,59 @@ async def check_database():
 
     # Check conversations collection
     conversations = db["conversations"]
-    conv_count = await conversations.count_documents({})
+    conv_count = await conversations.estimated_document_count()
 
     print(f"\nCONVERSATIONS COLLECTION:")
     print(f"   Total documents: {conv_count}")
     print("-" * 80)
 
-    async for conv in conversations.find():
-        print(f"\n   Conversation ID: {conv['_id']}")
-        print(f"   Title: {conv['title']}")
-        print(f"   Created: {conv['created_at']}")
-        print(f"   Updated: {conv['updated_at']}")
-        print(f"   Message Count: {conv['message_count']}")
+    async for batch in iter_batches(conversations.find({}, CONVERSATION_PROJECTION)):
+        lines = []
+        for conv in batch:
+            lines.append(f"\n   Conversation ID: {conv['_id']}")
+            lines.append(f"   Title: {conv['title']}")
+            lines.append(f"   Created: {conv['created_at']}")
+            lines.append(f"   Updated: {conv['updated_at']}")
+            lines.append(f"   Message Count: {conv['message_count']}")
+        # One write per batch instead of one per line
+        sys.stdout.write("\n".join(lines) + "\n")
 
     # Check messages collection
     messages = db["messages"]
-    msg_count = await messages.count_documents({})
+    msg_count = await messages.estimated_document_count()
 
     print(f"\n\nMESSAGES COLLECTION:")
     print(f"   Total documents: {msg_count}")
     print("-" * 80)
 
-    async for msg in messages.find().sort("timestamp", 1):
-        print(f"\n   Message ID: {msg['_id']}")
-        print(f"   Conversation: {msg['conversation_id']}")
-        print(f"   Role: {msg['role'].upper()}")
-        print(f"   Timestamp: {msg['timestamp']}")
-        print(f"   Content Items: {len(msg['content'])}")
-
-        for i, content in enumerate(msg['content'], 1):
-            content_type = content['type']
-            print(f"      [{i}] Type: {content_type}")
-
-            if content_type == 'text' and content.get('text'):
-                text_preview = content['text'][:100] + "..." if len(content['text']) > 100 else content['text']
-                print(f"          Text: {text_preview}")
-
-            elif content_type == 'csv' and content.get('csv_data'):
-                csv_info = content['csv_data'].get('basic_info', {})
-                print(f"          CSV: {csv_info.get('rows', 'N/A')} rows × {csv_info.get('columns', 'N/A')} columns")
-                if 'column_names' in csv_info:
-                    print(f"          Columns: {', '.join(csv_info['column_names'])}")
-
-            elif content_type == 'image':
-                print(f"          Image: [Base64 data present]")
+    # No global timestamp index (only per conversation), so let the server sort on disk
+    async for batch in iter_batches(messages.find({}, MESSAGE_PROJECTION, allow_disk_use=True).sort("timestamp", 1)):
+        lines = []
+        for msg in batch:
+            lines.append(f"\n   Message ID: {msg['_id']}")
+            lines.append(f"   Conversation: {msg['conversation_id']}")
+            lines.append(f"   Role: {msg['role'].upper()}")
+            lines.append(f"   Timestamp: {msg['timestamp']}")
+            lines.append(f"   Content Items: {len(msg['content'])}")
+
+            for i, content in enumerate(msg['content'], 1):
+                content_type = content['type']
+                lines.append(f"      [{i}] Type: {content_type}")
+
+                if content_type == 'text' and content.get('text'):
+                    text_preview = content['text'][:100] + "..." if len(content['text']) > 100 else content['text']
+                    lines.append(f"          Text: {text_preview}")
+
+                elif content_type == 'csv' and content.get('csv_data'):
+                    csv_info = content['csv_data'].get('basic_info', {})
+                    lines.append(f"          CSV: {csv_info.get('rows', 'N/A')} rows × {csv_info.get('columns', 'N/A')} columns")
+                    if 'column_names' in csv_info:
+                        lines.append(f"          Columns: {', '.join(csv_info['column_names'])}")
+
+                elif content_type == 'image':
+                    lines.append(f"          Image: [Base64 data present]")
+        # One write per batch instead of one per line
+        sys.stdout.write("\n".join(lines) + "\n")
 
     print("\n" + "=" * 80)
     print("DATABASE CHECK COMPLETE")
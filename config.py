@@ -1,5 +1,7 @@
-from pydantic_settings import BaseSettings
-from typing import Optional
+from functools import lru_cache
+from pydantic import field_validator
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
+from typing import Annotated, Any, FrozenSet, Optional
 
 
 class Settings(BaseSettings):
@@ -10,7 +12,18 @@ class Settings(BaseSettings):
     openai_api_key: Optional[str] = None
     openai_model: str = "gpt-4o-mini"
     max_file_size_mb: int = 10
-    allowed_image_types: str = "image/jpeg,image/png,image/jpg"
+    # Comma-separated in the environment, parsed once into a set for O(1) lookups
+    allowed_image_types: Annotated[FrozenSet[str], NoDecode] = frozenset({"image/jpeg", "image/png", "image/jpg"})
+
+    # MongoDB connection pool configuration
+    mongodb_max_pool_size: int = 200  # Each chat turn issues several DB calls
+    mongodb_min_pool_size: int = 200  # Keep min == max so sockets are never created on demand
+    mongodb_wait_queue_timeout_ms: int = 5000  # Fail fast instead of queueing forever when saturated
+    mongodb_max_idle_time_ms: int = 300000  # Recycle sockets idle this long before a firewall silently drops them
+
+    # Directory for downloaded CSVs, kept with their ETag/Last-Modified for conditional GETs
+    csv_cache_dir: str = ".cache/csv"
+    csv_cache_max_mb: int = 512  # Least recently used downloads are removed beyond this
 
     # Sliding window configuration
     sliding_window_enabled: bool = True
@@ -18,9 +31,27 @@ class Settings(BaseSettings):
     sliding_window_preserve_first: int = 2  # Always keep first N messages for context
     sliding_window_token_limit: int = 100000  # Soft token limit (for GPT-4)
 
-    class Config:
-        env_file = ".env"
-        case_sensitive = False
+    @field_validator("allowed_image_types", mode="before")
+    @classmethod
+    def _parse_allowed_image_types(cls, value: Any) -> Any:
+        """Accept a comma-separated string as well as any iterable of MIME types"""
+        if isinstance(value, str):
+            return frozenset(item.strip() for item in value.split(",") if item.strip())
+        return value
+
+    # Frozen: settings are read-only after startup
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        case_sensitive=False,
+        extra="ignore",
+        frozen=True
+    )
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Parse the environment once and return the shared Settings instance"""
+    return Settings()
 
 
-settings = Settings()
+settings = get_settings()
@@ -1,6 +1,8 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import IndexModel
 from typing import Optional
 from config import settings
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,6 +12,7 @@ class MongoDB:
 
     client: Optional[AsyncIOMotorClient] = None
     database = None
+    _index_task: Optional[asyncio.Task] = None
 
     @classmethod
     async def connect(cls):
@@ -17,9 +20,10 @@ class MongoDB:
         # Configure connection pool for better performance
         cls.client = AsyncIOMotorClient(
             settings.mongodb_url,
-            maxPoolSize=50,  # Maximum connections in pool
-            minPoolSize=10,  # Minimum connections to maintain
-            maxIdleTimeMS=45000,  # Close idle connections after 45s
+            maxPoolSize=settings.mongodb_max_pool_size,  # Maximum connections in pool
+            minPoolSize=settings.mongodb_min_pool_size,  # Minimum connections to maintain
+            waitQueueTimeoutMS=settings.mongodb_wait_queue_timeout_ms,  # Max wait for a free connection
+            maxIdleTimeMS=settings.mongodb_max_idle_time_ms,  # Replace long-idle connections
             serverSelectionTimeoutMS=5000,  # Timeout for server selection
             connectTimeoutMS=10000,  # Connection timeout
             socketTimeoutMS=20000,  # Socket timeout
@@ -27,23 +31,41 @@ class MongoDB:
         cls.database = cls.client[settings.database_name]
         logger.info(f"Connected to MongoDB: {settings.database_name}")
 
-        # Create indexes for better query performance
-        await cls._create_indexes()
+        # Build indexes in the background so startup doesn't wait on the cluster;
+        # create_indexes is idempotent when the indexes already exist
+        cls._index_task = asyncio.create_task(cls._create_indexes())
 
     @classmethod
     async def _create_indexes(cls):
         """Create database indexes for optimized queries"""
         try:
             # Conversations collection indexes
+            # updated_at backs list_conversations' "most recent first" sort
             conversations = cls.database["conversations"]
-            await conversations.create_index("created_at")
-            await conversations.create_index("updated_at")
+            await conversations.create_indexes([
+                IndexModel("updated_at")
+            ])
 
             # Messages collection indexes
+            # (conversation_id, timestamp, _id) follows the equality-sort order of get_messages,
+            # with _id as the tie-break of keyset pages; its prefixes also serve
+            # (conversation_id, timestamp) sorts and plain conversation_id lookups
             messages = cls.database["messages"]
-            await messages.create_index("conversation_id")
-            await messages.create_index([("conversation_id", 1), ("timestamp", 1)])
-            await messages.create_index("timestamp")
+            await messages.create_indexes([
+                IndexModel([("conversation_id", 1), ("timestamp", 1), ("_id", 1)], background=True)
+            ])
+
+            # Drop indexes left by earlier versions that no query uses (or that are
+            # covered by the compound index); each one only slows down writes
+            obsolete_indexes = [
+                (conversations, ["created_at_1"]),
+                (messages, ["conversation_id_1", "timestamp_1", "conversation_id_1_timestamp_1"])
+            ]
+            for collection, index_names in obsolete_indexes:
+                index_info = await collection.index_information()
+                for index_name in index_names:
+                    if index_name in index_info:
+                        await collection.drop_index(index_name)
 
             logger.info("Database indexes created successfully")
         except Exception as e:
@@ -52,6 +74,10 @@ class MongoDB:
     @classmethod
     async def close(cls):
         """Close MongoDB connection"""
+        if cls._index_task and not cls._index_task.done():
+            cls._index_task.cancel()
+        cls._index_task = None
+
         if cls.client:
             cls.client.close()
             print("MongoDB connection closed")
@@ -63,6 +89,13 @@ class MongoDB:
             raise Exception("Database not connected")
         return cls.database[collection_name]
 
+    @classmethod
+    def get_gridfs_bucket(cls, bucket_name: str) -> AsyncIOMotorGridFSBucket:
+        """Get a GridFS bucket for binary payloads (e.g. uploaded images)"""
+        if cls.database is None:
+            raise Exception("Database not connected")
+        return AsyncIOMotorGridFSBucket(cls.database, bucket_name=bucket_name)
+
 
 # Convenience function to get database instance
 def get_db():
@@ -1,8 +1,15 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
 from database import MongoDB
-from routers import conversations, chat, sessions_v2, chat_v2
+from services.ai_service import AIService
+from services.csv_service import CSVService
+from routers import conversations, chat, images, sessions_v2, chat_v2
 
 
 @asynccontextmanager
@@ -11,9 +18,20 @@ async def lifespan(app: FastAPI):
     # Startup
     print("Starting up application...")
     await MongoDB.connect()
+    # Worker processes for pandas parsing/analysis so CSV work never blocks the event loop.
+    # "spawn" avoids forking a process that already runs Motor's and aiohttp's threads.
+    app.state.cpu_pool = ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+    # Shared CSV service so the aiohttp session and SmartDataframe cache survive across requests
+    app.state.csv_service = CSVService(cpu_pool=app.state.cpu_pool)
     yield
     # Shutdown
     print("Shutting down application...")
+    await app.state.csv_service.close_session()
+    await AIService.close_client()
+    app.state.cpu_pool.shutdown(wait=False, cancel_futures=True)
     await MongoDB.close()
 
 
@@ -21,7 +39,8 @@ app = FastAPI(
     title="Chat Application API",
     description="Multi-turn chat with image and CSV data support",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # Faster encoding of large base64/CSV payloads
 )
 
 # CORS middleware
@@ -33,9 +52,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON responses; message lists and exports compress well.
+# Streams and images opt out by setting Content-Encoding themselves.
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Include routers
 app.include_router(conversations.router)
 app.include_router(chat.router)
+app.include_router(images.router)
 
 # Include v2 routers for frontend integration
 app.include_router(sessions_v2.router)
@@ -81,5 +105,7 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True
+        reload=True,
+        loop="auto",  # uvloop (libuv) where installed; it is not available on Windows
+        http="httptools"  # C HTTP parser instead of h11
     )
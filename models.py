@@ -1,9 +1,14 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import Enum
 
 
+def utc_now() -> datetime:
+    """Timezone-aware current UTC time (datetime.utcnow is deprecated)"""
+    return datetime.now(timezone.utc)
+
+
 class MessageRole(str, Enum):
     """Message role enumeration"""
     USER = "user"
@@ -33,29 +38,19 @@ class Message(BaseModel):
     conversation_id: str
     role: MessageRole
     content: List[MessageContent]
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=utc_now)
     metadata: Optional[Dict[str, Any]] = None
 
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
-
 
 class Conversation(BaseModel):
     """Conversation model"""
     id: Optional[str] = None
     title: Optional[str] = "New Conversation"
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utc_now)
+    updated_at: datetime = Field(default_factory=utc_now)
     message_count: int = 0
     metadata: Optional[Dict[str, Any]] = None
 
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
-
 
 class CreateConversationRequest(BaseModel):
     """Request model for creating a conversation"""
@@ -77,6 +72,17 @@ class CSVAnalysisRequest(BaseModel):
     csv_url: Optional[str] = None
 
 
+class ChatV2Request(BaseModel):
+    """Request model for the v2 text chat endpoints"""
+    session_id: str = Field(..., min_length=1)
+    message: str = Field(..., min_length=1)
+
+
+class SessionBatchRequest(BaseModel):
+    """Request model for loading several v2 sessions at once"""
+    session_ids: List[str] = Field(..., min_length=1, max_length=100)
+
+
 class ConversationResponse(BaseModel):
     """Response model for conversation"""
     id: str
@@ -93,3 +99,25 @@ class MessageResponse(BaseModel):
     role: MessageRole
     content: List[MessageContent]
     timestamp: datetime
+
+    @classmethod
+    def from_document(cls, message: Dict[str, Any], include_csv_data: bool = True) -> "MessageResponse":
+        """
+        Build a response from a stored message without re-validating it.
+        Stored messages were validated on write, so model_construct skips walking
+        large base64/CSV payloads again.
+        """
+        content = []
+        for item in message["content"]:
+            if not include_csv_data and item.get("csv_data") is not None:
+                item = {**item, "csv_data": None}
+            # Stored as a plain string; the enum keeps serialization free of type warnings
+            content.append(MessageContent.model_construct(**{**item, "type": MessageType(item["type"])}))
+
+        return cls.model_construct(
+            id=message["id"],
+            conversation_id=message["conversation_id"],
+            role=MessageRole(message["role"]),
+            content=content,
+            timestamp=message["timestamp"]
+        )
@@ -1,171 +1,330 @@
-from fastapi import APIRouter, HTTPException, status, UploadFile, File, Form
-from typing import Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status, UploadFile, Form
+from fastapi.responses import Response, StreamingResponse
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+from bson import ObjectId
 from models import (
     SendMessageRequest,
     MessageResponse,
     MessageRole,
-    MessageType,
-    MessageContent
+    MessageType
 )
+from routers.dependencies import require_csv_upload
 from services.chat_service import ChatService
 from services.image_service import ImageService
 from services.csv_service import CSVService
-from services.ai_service import AIService
+from services.ai_service import AIService, SYSTEM_PROMPT
+from services.context_window import ContextWindowService
+from services.sse import batch_events, sse_chunk, sse_event
+from services.timing import PhaseTimer
+from services.upload_service import UploadService
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
 
+async def _store_visualization(analysis: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Store a generated visualization in GridFS
+    Returns the analysis with its inline image swapped for the image URL, and the stored image URI
+    """
+    if not analysis or analysis.get("type") != "visualization" or not analysis.get("result", {}).get("image_data"):
+        return analysis, None
+
+    stored_image_url = await ImageService.store_image(analysis["result"]["image_data"])
+    analysis = {**analysis, "result": {
+        **analysis["result"],
+        "image_data": ImageService.public_image_url(stored_image_url)
+    }}
+    return analysis, stored_image_url
+
+
+def _cancel_task(task: asyncio.Task):
+    """Cancel a prefetch task whose result is no longer needed, retrieving its outcome once done"""
+    task.cancel()
+    # A task that already failed (or fails while stopping) would otherwise log "exception was never retrieved"
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+
+async def _delete_turn_images(image_urls: List[str]):
+    """Delete images stored for a turn that failed before its messages were saved"""
+    if image_urls:
+        await ImageService.delete_images(image_urls)
+
+
+def _build_assistant_content(text: str, visualization_url: Optional[str]) -> List[Dict[str, Any]]:
+    """Assistant reply content, with the stored visualization attached if any"""
+    assistant_content = [{"type": MessageType.TEXT.value, "text": text}]
+
+    if visualization_url:
+        assistant_content.append({"type": MessageType.IMAGE.value, "image_url": visualization_url})
+
+    return assistant_content
+
+
+def _message_response(message: Dict[str, Any], include_csv_data: bool = True) -> MessageResponse:
+    """Response for a stored message, pointing clients at /api/images for stored images"""
+    return MessageResponse.from_document(ImageService.with_public_image_urls(message), include_csv_data)
+
+
 @router.post("/message", response_model=dict)
 async def send_message(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
     conversation_id: str = Form(...),
     content: str = Form(...),
     image_data: Optional[str] = Form(None),
-    csv_url: Optional[str] = Form(None)
+    csv_url: Optional[str] = Form(None),
+    include_csv_data: bool = Form(True),
+    stream: bool = Form(False)
 ):
     """
     Send a message in a conversation
     Supports text, image, and CSV data
+
+    With include_csv_data=false the CSV analysis is left out of the response;
+    it stays on the stored user message (csv_message_id) and can be fetched later.
+
+    With stream=true the reply is sent as Server-Sent Events while it is generated
+    and both messages are stored after the stream has been flushed.
+
+    Phase timings are returned in a Server-Timing header (and in the final
+    event when streaming).
     """
     try:
-        # Verify conversation exists
-        conversation = await ChatService.get_conversation(conversation_id)
-        if not conversation:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Conversation not found"
-            )
+        timer = PhaseTimer("send_message")
+        csv_service: CSVService = request.app.state.csv_service
+        image_task = None
+        csv_task = None
+
+        try:
+            # Work that doesn't depend on the conversation starts before it is loaded:
+            # validate the image off the event loop and download a newly provided CSV
+            if image_data:
+                image_task = asyncio.create_task(
+                    asyncio.to_thread(ImageService.validate_image, image_data)
+                )
+            if csv_url:
+                csv_task = asyncio.create_task(csv_service.load_csv_from_url(csv_url))
 
-        # Build user message content
+            # Verify conversation exists and load its history window in the same round trip
+            with timer.phase("db"):
+                conversation = await ChatService.get_conversation_with_window(conversation_id)
+            if not conversation:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Conversation not found"
+                )
+            history = conversation.pop("messages")
+
+            # Handle CSV if provided OR check if conversation has existing CSV data
+            csv_analysis = None
+            csv_content = None
+            visualization_url = None
+            active_csv_url = csv_url  # Track the active CSV URL
+            stored_csv = None  # Metadata referencing an uploaded CSV
+
+            # If no csv_url provided, check if conversation metadata has stored CSV
+            if not csv_url:
+                metadata = conversation.get("metadata", {})
+
+                # Check for CSV URL (for URL-based CSVs)
+                if metadata.get("active_csv_url"):
+                    active_csv_url = metadata["active_csv_url"]
+
+                # Check for an uploaded CSV (GridFS, or base64 from older versions)
+                elif metadata.get("active_csv_gridfs_id") or metadata.get("active_csv_data"):
+                    stored_csv = metadata
+
+            if active_csv_url or stored_csv:
+                try:
+                    # A new CSV replaces whatever SmartDataframe was cached for this conversation
+                    if csv_url:
+                        csv_service.clear_cache(conversation_id)
+
+                    # Load dataframe from URL or data
+                    with timer.phase("csv_load"):
+                        if csv_task:
+                            df = await csv_task
+                        elif active_csv_url:
+                            df = await csv_service.load_csv_from_url(active_csv_url)
+                        else:
+                            df = await csv_service.load_stored_dataframe(stored_csv)
+
+                    with timer.phase("csv_analyze"):
+                        csv_analysis = await csv_service.analyze_query(df, content, conversation_id=conversation_id)
+
+                        # Store a generated visualization once and refer to it by URL from here on
+                        csv_analysis, visualization_url = await _store_visualization(csv_analysis)
+
+                    # csv_analysis comes straight from CSVService, no need to validate it
+                    csv_content = {
+                        "type": MessageType.CSV.value,
+                        "csv_url": active_csv_url,
+                        "csv_data": csv_analysis
+                    }
+                except Exception as e:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"CSV error: {str(e)}"
+                    )
+
+            if image_task:
+                with timer.phase("image"):
+                    is_valid, error = await image_task
+                if not is_valid:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=error
+                    )
+        except BaseException:
+            for task in (image_task, csv_task):
+                if task:
+                    _cancel_task(task)
+            raise
+
+        # Build user message content as plain dicts: everything here is validated
+        # already, so there's nothing for Pydantic to check before the write
         user_content = []
 
         # Add text content
         if content:
-            user_content.append(MessageContent(
-                type=MessageType.TEXT,
-                text=content
-            ))
+            user_content.append({"type": MessageType.TEXT.value, "text": content})
 
-        # Handle image if provided
+        # Add the image, keeping only its GridFS URI in the message
+        stored_image_url = None
         if image_data:
-            is_valid, error = ImageService.validate_image(image_data)
-            if not is_valid:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=error
-                )
+            with timer.phase("image"):
+                stored_image_url = await ImageService.store_image(image_data)
+            user_content.append({"type": MessageType.IMAGE.value, "image_url": stored_image_url})
 
-            user_content.append(MessageContent(
-                type=MessageType.IMAGE,
-                image_url=image_data
-            ))
-
-        # Handle CSV if provided OR check if conversation has existing CSV data
-        csv_analysis = None
-        visualization_image = None
-        active_csv_url = csv_url  # Track the active CSV URL
-        active_csv_data = None  # Track uploaded CSV data
-
-        # If no csv_url provided, check if conversation metadata has stored CSV
-        if not csv_url:
-            metadata = conversation.get("metadata", {})
-
-            # Check for CSV URL (for URL-based CSVs)
-            if metadata.get("active_csv_url"):
-                active_csv_url = metadata["active_csv_url"]
-
-            # Check for uploaded CSV data (base64 encoded)
-            elif metadata.get("active_csv_data"):
-                import base64
-                active_csv_data = base64.b64decode(metadata["active_csv_data"])
-
-        if active_csv_url or active_csv_data:
-            try:
-                csv_service = CSVService()
-
-                # Load dataframe from URL or data
-                if active_csv_url:
-                    df = await csv_service.load_csv_from_url(active_csv_url)
-                else:
-                    df = CSVService.load_csv_from_bytes(active_csv_data)
-
-                csv_analysis = await csv_service.analyze_query(df, content, conversation_id=conversation_id)
-                await csv_service.close_session()
-
-                # Check if visualization was generated
-                if csv_analysis.get("type") == "visualization" and csv_analysis.get("result", {}).get("image_data"):
-                    visualization_image = csv_analysis["result"]["image_data"]
-
-                user_content.append(MessageContent(
-                    type=MessageType.CSV,
-                    csv_url=active_csv_url,
-                    csv_data=csv_analysis
-                ))
-
-                # Store CSV URL in conversation metadata for future use (only for new uploads)
-                if csv_url:  # Only update if this is a new CSV upload
-                    await ChatService.update_conversation_metadata(
-                        conversation_id=conversation_id,
-                        metadata={"active_csv_url": active_csv_url}
-                    )
-            except Exception as e:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"CSV error: {str(e)}"
-                )
+        if csv_content:
+            user_content.append(csv_content)
 
-        # Save user message
-        user_message = await ChatService.add_message(
+        # The user message is persisted together with the assistant reply below
+        user_message = ChatService.build_message(
             conversation_id=conversation_id,
             role=MessageRole.USER,
             content=user_content
         )
 
-        # Get conversation history for AI
-        messages = await ChatService.get_messages(conversation_id)
+        # Remember a newly provided CSV URL for future turns (only for new uploads)
+        # Awaited: the next turn reads it, so it must not race a quick follow-up message
+        if csv_content and csv_url:
+            await ChatService.update_conversation_metadata(
+                conversation_id=conversation_id,
+                metadata={"active_csv_url": active_csv_url}
+            )
+
+        # Append the not-yet-stored user message and re-apply the window limits
+        # The model gets the image inline, so use the data we already have for this turn
+        prompt_user_message = user_message
+        if stored_image_url:
+            prompt_user_message = {**user_message, "content": [
+                {**item, "image_url": image_data} if item.get("image_url") == stored_image_url else item
+                for item in user_message["content"]
+            ]}
+
+        messages = ContextWindowService.apply_sliding_window(
+            history + [prompt_user_message],
+            total_messages=conversation.get("message_count", 0) + 1
+        )["messages"]
+        messages = await ImageService.resolve_stored_images(messages)
         formatted_messages = AIService.format_conversation_history(messages)
 
-        # Generate AI response
-        ai_response_text = await AIService.generate_response(
-            formatted_messages,
-            AIService.create_system_prompt()
-        )
+        # Images stored for this turn; deleted again if the turn can't be saved
+        turn_images = [url for url in (stored_image_url, visualization_url) if url]
+
+        if stream:
+            chunks: List[str] = []
+            assistant_id = ObjectId()  # Known up front so the done event can reference it
+
+            async def stream_tokens():
+                """Yield the reply as SSE events while accumulating it for persistence"""
+                try:
+                    with timer.phase("llm"):
+                        async for chunk in AIService.generate_response_stream(
+                            formatted_messages,
+                            SYSTEM_PROMPT
+                        ):
+                            chunks.append(chunk)
+                            yield sse_chunk(chunk)
+                except Exception:
+                    await _delete_turn_images(turn_images)
+                    raise
+
+                timer.log()
+                completion_data = {
+                    'done': True,
+                    'user_message_id': user_message["id"],
+                    'message_id': str(assistant_id),
+                    'csv_message_id': user_message["id"] if csv_analysis else None,
+                    'timings': timer.durations
+                }
+                if visualization_url:
+                    completion_data['visualization'] = ImageService.public_image_url(visualization_url)
+                yield sse_event(completion_data)
+
+            async def persist_turn():
+                """Store the turn once the response has been sent"""
+                assistant_message = ChatService.build_message(
+                    conversation_id=conversation_id,
+                    role=MessageRole.ASSISTANT,
+                    content=_build_assistant_content("".join(chunks), visualization_url)
+                )
+                assistant_message["_id"] = assistant_id
+                assistant_message["id"] = str(assistant_id)
+                try:
+                    await ChatService.add_messages_bulk(conversation_id, [user_message, assistant_message])
+                except Exception:
+                    await _delete_turn_images(turn_images)
+                    raise
+
+            # A response with its own background replaces the injected tasks, so queue it with them
+            background_tasks.add_task(persist_turn)
+            return StreamingResponse(
+                batch_events(stream_tokens()),
+                media_type="text/event-stream",
+                headers={
+                    "Cache-Control": "no-cache",
+                    "Connection": "keep-alive",
+                    "Content-Encoding": "identity",  # Keeps GZipMiddleware from buffering the event stream
+                    "X-Accel-Buffering": "no",  # Same for nginx-style reverse proxies
+                    "Server-Timing": timer.server_timing(),  # Phases before the stream started
+                },
+                background=background_tasks
+            )
 
-        # Save assistant message
-        assistant_content = [MessageContent(
-            type=MessageType.TEXT,
-            text=ai_response_text
-        )]
+        try:
+            # Generate AI response
+            with timer.phase("llm"):
+                ai_response_text = await AIService.generate_response(
+                    formatted_messages,
+                    SYSTEM_PROMPT
+                )
 
-        # Add visualization image to assistant message if generated
-        if visualization_image:
-            assistant_content.append(MessageContent(
-                type=MessageType.IMAGE,
-                image_url=visualization_image
-            ))
+            # Save assistant message
+            assistant_message = ChatService.build_message(
+                conversation_id=conversation_id,
+                role=MessageRole.ASSISTANT,
+                content=_build_assistant_content(ai_response_text, visualization_url)
+            )
 
-        assistant_message = await ChatService.add_message(
-            conversation_id=conversation_id,
-            role=MessageRole.ASSISTANT,
-            content=assistant_content
-        )
+            # Save both messages of the turn in one round trip
+            with timer.phase("save"):
+                await ChatService.add_messages_bulk(conversation_id, [user_message, assistant_message])
+        except Exception:
+            await _delete_turn_images(turn_images)
+            raise
 
+        timer.log()
+        response.headers["Server-Timing"] = timer.server_timing()
         return {
-            "user_message": MessageResponse(
-                id=user_message["id"],
-                conversation_id=user_message["conversation_id"],
-                role=user_message["role"],
-                content=user_message["content"],
-                timestamp=user_message["timestamp"]
-            ),
-            "assistant_message": MessageResponse(
-                id=assistant_message["id"],
-                conversation_id=assistant_message["conversation_id"],
-                role=assistant_message["role"],
-                content=assistant_message["content"],
-                timestamp=assistant_message["timestamp"]
-            ),
-            "csv_analysis": csv_analysis,
-            "visualization": visualization_image
+            "user_message": _message_response(user_message, include_csv_data),
+            "assistant_message": _message_response(assistant_message),
+            "csv_analysis": csv_analysis if include_csv_data else None,
+            "csv_message_id": user_message["id"] if csv_analysis else None,
+            "visualization": ImageService.public_image_url(visualization_url)
         }
 
     except HTTPException:
@@ -179,120 +338,97 @@ async def send_message(
 
 @router.post("/upload-csv")
 async def upload_csv_file(
-    file: UploadFile = File(...),
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = Depends(require_csv_upload),
     conversation_id: str = Form(...),
     query: str = Form("summarize")
 ):
     """Upload a CSV file and analyze it"""
     try:
-        # Verify conversation exists
-        conversation = await ChatService.get_conversation(conversation_id)
+        # Verify conversation exists and load its history window in the same round trip
+        conversation = await ChatService.get_conversation_with_window(conversation_id)
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Conversation not found"
             )
-
-        # Validate file type
-        if not file.filename.endswith('.csv'):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Only CSV files are allowed"
-            )
+        history = conversation.pop("messages")
 
         # Read file
-        contents = await file.read()
+        contents = await UploadService.read_upload(file)
 
         # Parse CSV and analyze
-        df = CSVService.load_csv_from_bytes(contents)
-        csv_service = CSVService()
+        csv_service: CSVService = request.app.state.csv_service
+        df = await csv_service.parse_csv_bytes(contents)
 
         # Store the dataframe in the service for future queries in this conversation
         # Note: For uploaded files, we need to cache the actual dataframe since there's no URL
+        csv_service.clear_cache(conversation_id)
         analysis = await csv_service.analyze_query(df, query, conversation_id=conversation_id)
-        await csv_service.close_session()
 
-        # Store CSV data (as string) in conversation metadata for future use
+        # Store the raw CSV in GridFS and reference it from conversation metadata
         # This allows multi-turn conversations to work with uploaded CSVs
-        import base64
-        csv_data_base64 = base64.b64encode(contents).decode('utf-8')
+        previous_csv_id = conversation.get("metadata", {}).get("active_csv_gridfs_id")
+        csv_file_id = await CSVService.store_csv(file.filename, contents, df)
 
         await ChatService.update_conversation_metadata(
             conversation_id=conversation_id,
             metadata={
                 "active_csv_filename": file.filename,
-                "active_csv_data": csv_data_base64,
+                "active_csv_gridfs_id": csv_file_id,
+                "active_csv_data": None,  # Drop the base64 copy written by older versions
                 "has_active_csv": True
             }
         )
+        background_tasks.add_task(CSVService.delete_stored_csv, previous_csv_id)
 
-        # Check if visualization was generated
-        visualization_image = None
-        if analysis.get("type") == "visualization" and analysis.get("result", {}).get("image_data"):
-            visualization_image = analysis["result"]["image_data"]
+        # Store a generated visualization once and refer to it by URL from here on
+        analysis, visualization_url = await _store_visualization(analysis)
 
         # Save user message with CSV data
         user_content = [
-            MessageContent(
-                type=MessageType.TEXT,
-                text=f"Uploaded CSV file: {file.filename}. Query: {query}"
-            ),
-            MessageContent(
-                type=MessageType.CSV,
-                csv_data=analysis
-            )
+            {"type": MessageType.TEXT.value, "text": f"Uploaded CSV file: {file.filename}. Query: {query}"},
+            {"type": MessageType.CSV.value, "csv_data": analysis}
         ]
 
-        user_message = await ChatService.add_message(
+        user_message = ChatService.build_message(
             conversation_id=conversation_id,
             role=MessageRole.USER,
             content=user_content
         )
 
-        # Generate AI response
-        messages = await ChatService.get_messages(conversation_id)
+        # Generate AI response (the user message is stored together with the reply)
+        messages = ContextWindowService.apply_sliding_window(
+            history + [user_message],
+            total_messages=conversation.get("message_count", 0) + 1
+        )["messages"]
+        messages = await ImageService.resolve_stored_images(messages)
         formatted_messages = AIService.format_conversation_history(messages)
-        ai_response_text = await AIService.generate_response(
-            formatted_messages,
-            AIService.create_system_prompt()
-        )
-
-        # Save assistant message
-        assistant_content = [MessageContent(
-            type=MessageType.TEXT,
-            text=ai_response_text
-        )]
+        try:
+            ai_response_text = await AIService.generate_response(
+                formatted_messages,
+                SYSTEM_PROMPT
+            )
 
-        # Add visualization image to assistant message if generated
-        if visualization_image:
-            assistant_content.append(MessageContent(
-                type=MessageType.IMAGE,
-                image_url=visualization_image
-            ))
+            # Save assistant message
+            assistant_message = ChatService.build_message(
+                conversation_id=conversation_id,
+                role=MessageRole.ASSISTANT,
+                content=_build_assistant_content(ai_response_text, visualization_url)
+            )
 
-        assistant_message = await ChatService.add_message(
-            conversation_id=conversation_id,
-            role=MessageRole.ASSISTANT,
-            content=assistant_content
-        )
+            # Save both messages of the turn in one round trip
+            await ChatService.add_messages_bulk(conversation_id, [user_message, assistant_message])
+        except Exception:
+            await _delete_turn_images([visualization_url] if visualization_url else [])
+            raise
 
         return {
             "analysis": analysis,
-            "user_message": MessageResponse(
-                id=user_message["id"],
-                conversation_id=user_message["conversation_id"],
-                role=user_message["role"],
-                content=user_message["content"],
-                timestamp=user_message["timestamp"]
-            ),
-            "assistant_message": MessageResponse(
-                id=assistant_message["id"],
-                conversation_id=assistant_message["conversation_id"],
-                role=assistant_message["role"],
-                content=assistant_message["content"],
-                timestamp=assistant_message["timestamp"]
-            ),
-            "visualization": visualization_image
+            "user_message": _message_response(user_message),
+            "assistant_message": _message_response(assistant_message),
+            "visualization": ImageService.public_image_url(visualization_url)
         }
 
     except HTTPException:
@@ -306,25 +442,31 @@ async def upload_csv_file(
 
 @router.post("/analyze-csv")
 async def analyze_csv(
+    request: Request,
     conversation_id: str = Form(...),
     csv_url: str = Form(...),
     query: str = Form("summarize")
 ):
     """Analyze a CSV from URL"""
     try:
-        # Verify conversation exists
-        conversation = await ChatService.get_conversation(conversation_id)
-        if not conversation:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Conversation not found"
-            )
+        # Start the download while the conversation is verified; the two are independent
+        csv_service: CSVService = request.app.state.csv_service
+        csv_task = asyncio.create_task(csv_service.load_csv_from_url(csv_url))
+        try:
+            conversation = await ChatService.get_conversation(conversation_id)
+            if not conversation:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Conversation not found"
+                )
+            df = await csv_task
+        except BaseException:
+            _cancel_task(csv_task)
+            raise
 
-        # Load CSV from URL and analyze
-        csv_service = CSVService()
-        df = await csv_service.load_csv_from_url(csv_url)
+        # Analyze the CSV
+        csv_service.clear_cache(conversation_id)
         analysis = await csv_service.analyze_query(df, query, conversation_id=conversation_id)
-        await csv_service.close_session()
 
         return {
             "success": True,
@@ -1,67 +1,90 @@
-from fastapi import APIRouter, HTTPException, status, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
-from typing import Optional
-import json
-import base64
-from io import BytesIO
-from models import MessageRole, MessageType, MessageContent
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status, UploadFile, File, Form
+from fastapi.responses import Response, StreamingResponse
+from typing import List, Optional
+import asyncio
+import re
+import pybase64
+from bson import ObjectId
+from config import settings
+from database import MongoDB
+from models import MessageRole, MessageType, ChatV2Request
+from routers.dependencies import optional_csv_file, require_csv_file
 from services.chat_service import ChatService
-from services.image_service import ImageService
+from services.image_service import ImageService, STORED_IMAGE_PREFIX
 from services.csv_service import CSVService
-from services.ai_service import AIService
+from services.ai_service import AIService, SYSTEM_PROMPT
+from services.context_window import ContextWindowService
+from services.sse import batch_events, sse_chunk, sse_event
+from services.timing import PhaseTimer
+from services.upload_service import UploadService
 
 router = APIRouter(prefix="/api/v2", tags=["chat-v2"])
 
+# CSV links auto-loaded from chat messages, compiled once at import
+CSV_URL_PATTERN = re.compile(
+    r'https?://[^\s]+\.csv|https?://raw\.githubusercontent\.com/[^\s]+|https?://gist\.githubusercontent\.com/[^\s]+',
+    re.IGNORECASE
+)
+
 
 @router.post("/chat")
-async def send_text_message(request: dict):
+async def send_text_message(request: ChatV2Request, response: Response):
     """
     Send a text message (non-streaming)
+    Phase timings are returned in a Server-Timing header
     """
     try:
-        session_id = request.get("session_id")
-        message = request.get("message")
-
-        if not session_id or not message:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="session_id and message are required"
-            )
+        timer = PhaseTimer("v2_send_text_message")
+        session_id = request.session_id
+        message = request.message
 
-        # Verify conversation exists
-        conversation = await ChatService.get_conversation(session_id)
+        # Verify conversation exists and load its history window in the same round trip
+        with timer.phase("db"):
+            conversation = await ChatService.get_conversation_with_window(session_id)
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Session not found"
             )
+        history = conversation.pop("messages")
 
-        # Save user message
-        user_content = [MessageContent(type=MessageType.TEXT, text=message)]
-        user_message = await ChatService.add_message(
+        # Build user message (stored together with the reply)
+        user_content = [{"type": MessageType.TEXT.value, "text": message}]
+        user_message = ChatService.build_message(
             conversation_id=session_id,
             role=MessageRole.USER,
             content=user_content
         )
 
-        # Get conversation history
-        messages = await ChatService.get_messages(session_id, apply_sliding_window=True)
+        # Append the new user message to the history window loaded above
+        messages = ContextWindowService.apply_sliding_window(
+            history + [user_message],
+            total_messages=conversation.get("message_count", 0) + 1
+        )["messages"]
+        messages = await ImageService.resolve_stored_images(messages)
         formatted_messages = AIService.format_conversation_history(messages)
 
         # Generate AI response
-        ai_response_text = await AIService.generate_response(
-            formatted_messages,
-            AIService.create_system_prompt()
-        )
+        with timer.phase("llm"):
+            ai_response_text = await AIService.generate_response(
+                formatted_messages,
+                SYSTEM_PROMPT
+            )
 
         # Save assistant message
-        assistant_content = [MessageContent(type=MessageType.TEXT, text=ai_response_text)]
-        assistant_message = await ChatService.add_message(
+        assistant_content = [{"type": MessageType.TEXT.value, "text": ai_response_text}]
+        assistant_message = ChatService.build_message(
             conversation_id=session_id,
             role=MessageRole.ASSISTANT,
             content=assistant_content
         )
 
+        # Save both messages of the turn in one round trip
+        with timer.phase("save"):
+            await ChatService.add_messages_bulk(session_id, [user_message, assistant_message])
+
+        timer.log()
+        response.headers["Server-Timing"] = timer.server_timing()
         return {
             "message_id": assistant_message["id"],
             "response": ai_response_text,
@@ -78,63 +101,61 @@ async def send_text_message(request: dict):
 
 
 @router.post("/chat/stream")
-async def send_text_message_stream(request: dict):
+async def send_text_message_stream(
+    request: ChatV2Request,
+    http_request: Request,
+    background_tasks: BackgroundTasks
+):
     """
     Send a text message with streaming response
     Supports CSV follow-up questions with visualizations
     Auto-detects CSV URLs in messages
+    Phase timings are sent in a Server-Timing header and the completion event
     """
     try:
-        session_id = request.get("session_id")
-        message = request.get("message")
-
-        if not session_id or not message:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="session_id and message are required"
-            )
+        timer = PhaseTimer("v2_send_text_message_stream")
+        session_id = request.session_id
+        message = request.message
 
-        # Verify conversation exists
-        conversation = await ChatService.get_conversation(session_id)
+        # Verify conversation exists and load its history window in the same round trip
+        with timer.phase("db"):
+            conversation = await ChatService.get_conversation_with_window(session_id)
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Session not found"
             )
+        history = conversation.pop("messages")
 
         # Detect CSV URL in message (support common raw CSV URLs)
-        import re
-        csv_url_pattern = r'https?://[^\s]+\.csv|https?://raw\.githubusercontent\.com/[^\s]+|https?://gist\.githubusercontent\.com/[^\s]+'
-        detected_csv_url = re.search(csv_url_pattern, message, re.IGNORECASE)
+        detected_csv_url = CSV_URL_PATTERN.search(message)
 
         metadata = conversation.get("metadata", {})
+        csv_service: CSVService = http_request.app.state.csv_service
 
         # If CSV URL detected and no active CSV, load it
         if detected_csv_url and not metadata.get("has_active_csv"):
             csv_url = detected_csv_url.group(0)
             try:
-                csv_service = CSVService()
-                df = await csv_service.load_csv_from_url(csv_url)
-                await csv_service.close_session()
+                with timer.phase("csv_load"):
+                    await csv_service.load_csv_from_url(csv_url)
+                csv_service.clear_cache(session_id)
 
-                # Store in metadata
-                csv_bytes = df.to_csv(index=False).encode('utf-8')
-                csv_data_base64 = base64.b64encode(csv_bytes).decode('utf-8')
+                # Store in metadata; URL-based CSVs are reloaded from the URL
                 csv_filename = csv_url.split('/')[-1] or "data.csv"
+                metadata_update = {
+                    "active_csv_filename": csv_filename,
+                    "active_csv_url": csv_url,
+                    "has_active_csv": True
+                }
 
                 await ChatService.update_conversation_metadata(
                     conversation_id=session_id,
-                    metadata={
-                        "active_csv_filename": csv_filename,
-                        "active_csv_data": csv_data_base64,
-                        "active_csv_url": csv_url,
-                        "has_active_csv": True
-                    }
+                    metadata=metadata_update
                 )
 
-                # Reload conversation to get updated metadata
-                conversation = await ChatService.get_conversation(session_id)
-                metadata = conversation.get("metadata", {})
+                # Apply the update locally instead of reloading the conversation
+                metadata = {**metadata, **metadata_update}
             except Exception as e:
                 print(f"Failed to auto-load CSV from URL: {str(e)}")
 
@@ -142,22 +163,22 @@ async def send_text_message_stream(request: dict):
         csv_analysis = None
         visualization_image = None
 
-        if metadata.get("has_active_csv") or metadata.get("active_csv_url") or metadata.get("active_csv_data"):
+        if (metadata.get("has_active_csv") or metadata.get("active_csv_url")
+                or metadata.get("active_csv_gridfs_id") or metadata.get("active_csv_data")):
             try:
-                csv_service = CSVService()
-
-                # Load CSV from URL or data
-                if metadata.get("active_csv_url"):
-                    df = await csv_service.load_csv_from_url(metadata["active_csv_url"])
-                elif metadata.get("active_csv_data"):
-                    csv_bytes = base64.b64decode(metadata["active_csv_data"])
-                    df = CSVService.load_csv_from_bytes(csv_bytes)
-                else:
-                    # Try to get CSV from cache using conversation_id
-                    df = None
+                # Load CSV from URL or data (the shared service reuses the download above)
+                with timer.phase("csv_load"):
+                    if metadata.get("active_csv_url"):
+                        df = await csv_service.load_csv_from_url(metadata["active_csv_url"])
+                    elif metadata.get("active_csv_gridfs_id") or metadata.get("active_csv_data"):
+                        df = await csv_service.load_stored_dataframe(metadata)
+                    else:
+                        # Try to get CSV from cache using conversation_id
+                        df = None
 
                 if df is not None:
-                    csv_analysis = await csv_service.analyze_query(df, message, conversation_id=session_id)
+                    with timer.phase("csv_analyze"):
+                        csv_analysis = await csv_service.analyze_query(df, message, conversation_id=session_id)
 
                     # Debug logging
                     print(f"[DEBUG] CSV Analysis Type: {csv_analysis.get('type')}")
@@ -169,62 +190,52 @@ async def send_text_message_stream(request: dict):
                         print(f"[DEBUG] Visualization image extracted! Length: {len(visualization_image)}")
                     else:
                         print(f"[DEBUG] No visualization found in csv_analysis")
-
-                await csv_service.close_session()
             except Exception as csv_error:
                 print(f"CSV processing error: {str(csv_error)}")
 
-        # Save user message
-        user_content = [MessageContent(type=MessageType.TEXT, text=message)]
+        # Build user message (stored together with the reply)
+        user_content = [{"type": MessageType.TEXT.value, "text": message}]
 
         # Add CSV analysis to user content if available
         if csv_analysis:
-            user_content.append(MessageContent(type=MessageType.CSV, csv_data=csv_analysis))
+            user_content.append({"type": MessageType.CSV.value, "csv_data": csv_analysis})
 
-        user_message = await ChatService.add_message(
+        user_message = ChatService.build_message(
             conversation_id=session_id,
             role=MessageRole.USER,
             content=user_content
         )
 
-        # Get conversation history
-        messages = await ChatService.get_messages(session_id, apply_sliding_window=True)
+        # Append the new user message to the history window loaded above
+        messages = ContextWindowService.apply_sliding_window(
+            history + [user_message],
+            total_messages=conversation.get("message_count", 0) + 1
+        )["messages"]
+        messages = await ImageService.resolve_stored_images(messages)
         formatted_messages = AIService.format_conversation_history(messages)
 
+        chunks: List[str] = []
+        assistant_id = ObjectId()  # Known up front so the done event can reference it
+
         async def generate_stream():
             """Generator function for streaming response"""
+            upstream = AIService.generate_response_stream(formatted_messages, SYSTEM_PROMPT)
             try:
-                full_response = ""
-
-                # Stream the AI response
-                async for chunk in AIService.generate_response_stream(
-                    formatted_messages,
-                    AIService.create_system_prompt()
-                ):
-                    full_response += chunk
-                    # Send chunk in SSE format
-                    yield f"data: {json.dumps({'chunk': chunk})}\n\n"
-
-                # Save assistant message after streaming
-                assistant_content = [MessageContent(type=MessageType.TEXT, text=full_response)]
-
-                # Add visualization image to assistant message if generated
-                if visualization_image:
-                    assistant_content.append(MessageContent(
-                        type=MessageType.IMAGE,
-                        image_url=visualization_image
-                    ))
-
-                assistant_message = await ChatService.add_message(
-                    conversation_id=session_id,
-                    role=MessageRole.ASSISTANT,
-                    content=assistant_content
-                )
+                # Stream the AI response, stopping early if the client has gone away
+                with timer.phase("llm"):
+                    async for chunk in upstream:
+                        if await http_request.is_disconnected():
+                            return
+                        chunks.append(chunk)
+                        # Send chunk in SSE format
+                        yield sse_chunk(chunk)
 
                 # Send completion message with visualization if available
+                timer.log()
                 completion_data = {
                     'done': True,
-                    'message_id': assistant_message['id']
+                    'message_id': str(assistant_id),
+                    'timings': timer.durations
                 }
 
                 if visualization_image:
@@ -233,18 +244,49 @@ async def send_text_message_stream(request: dict):
                 else:
                     print(f"[DEBUG] No visualization to send in completion")
 
-                yield f"data: {json.dumps(completion_data)}\n\n"
+                yield sse_event(completion_data)
 
             except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield sse_event({"error": str(e)})
+            finally:
+                # Closes the upstream LLM stream so it stops generating tokens nobody reads
+                await upstream.aclose()
+
+        async def persist_turn():
+            """Store the turn once the response has been sent (partial if the client left early)"""
+            if not chunks:
+                return
+
+            assistant_content = [{"type": MessageType.TEXT.value, "text": "".join(chunks)}]
+
+            # Add visualization image to assistant message if generated
+            if visualization_image:
+                assistant_content.append({"type": MessageType.IMAGE.value, "image_url": visualization_image})
+
+            assistant_message = ChatService.build_message(
+                conversation_id=session_id,
+                role=MessageRole.ASSISTANT,
+                content=assistant_content
+            )
+            assistant_message["_id"] = assistant_id
+            assistant_message["id"] = str(assistant_id)
+
+            # Save both messages of the turn in one round trip
+            await ChatService.add_messages_bulk(session_id, [user_message, assistant_message])
 
+        # Stored after the last event is sent, so the stream isn't held open by the write
+        background_tasks.add_task(persist_turn)
         return StreamingResponse(
-            generate_stream(),
+            batch_events(generate_stream()),
             media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
-            }
+                "Content-Encoding": "identity",  # Keeps GZipMiddleware from buffering the event stream
+                "X-Accel-Buffering": "no",  # Same for nginx-style reverse proxies
+                "Server-Timing": timer.server_timing(),  # Phases before the stream started
+            },
+            background=background_tasks
         )
 
     except HTTPException:
@@ -264,66 +306,97 @@ async def send_image_message(
 ):
     """
     Send a message with an image
+    The image is stored in GridFS and referenced from the message by URI
     """
     try:
-        # Verify conversation exists
-        conversation = await ChatService.get_conversation(session_id)
+        # Read the upload, refusing oversized ones before they are buffered
+        try:
+            image_bytes = await UploadService.read_upload(
+                image,
+                max_size=settings.max_file_size_mb * 1024 * 1024
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Image size exceeds {settings.max_file_size_mb}MB limit"
+            )
+        image_type = image.content_type or "image/jpeg"
+
+        # Validate off the event loop while the conversation and its history window load
+        (is_valid, error), conversation = await asyncio.gather(
+            asyncio.to_thread(ImageService.validate_image_bytes, image_bytes, image_type),
+            ChatService.get_conversation_with_window(session_id)
+        )
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Session not found"
             )
-
-        # Read and encode image
-        image_bytes = await image.read()
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-
-        # Determine image type
-        image_type = image.content_type or "image/jpeg"
-        image_data = f"data:{image_type};base64,{image_base64}"
-
-        # Validate image
-        is_valid, error = ImageService.validate_image(image_data)
         if not is_valid:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=error
             )
+        history = conversation.pop("messages")
 
-        # Save user message
+        # Build user message (stored together with the reply)
+        # The file id is assigned up front so the message can reference it before the upload
+        image_id = ObjectId()
         user_content = [
-            MessageContent(type=MessageType.TEXT, text=message),
-            MessageContent(type=MessageType.IMAGE, image_url=image_data)
+            {"type": MessageType.TEXT.value, "text": message},
+            {"type": MessageType.IMAGE.value, "image_url": f"{STORED_IMAGE_PREFIX}{image_id}"}
         ]
-        user_message = await ChatService.add_message(
+        user_message = ChatService.build_message(
             conversation_id=session_id,
             role=MessageRole.USER,
             content=user_content
         )
 
-        # Get conversation history
-        messages = await ChatService.get_messages(session_id, apply_sliding_window=True)
+        # The model gets this turn's image inline, encoded once from the bytes we already have
+        prompt_user_message = {**user_message, "content": [
+            user_content[0],
+            {
+                "type": MessageType.IMAGE.value,
+                "image_url": f"data:{image_type};base64,{pybase64.b64encode(image_bytes).decode('ascii')}"
+            }
+        ]}
+
+        # Append the new user message to the history window loaded above
+        messages = ContextWindowService.apply_sliding_window(
+            history + [prompt_user_message],
+            total_messages=conversation.get("message_count", 0) + 1
+        )["messages"]
+        messages = await ImageService.resolve_stored_images(messages)
         formatted_messages = AIService.format_conversation_history(messages)
 
         # Generate AI response
         ai_response_text = await AIService.generate_response(
             formatted_messages,
-            AIService.create_system_prompt()
+            SYSTEM_PROMPT
         )
 
         # Save assistant message
-        assistant_content = [MessageContent(type=MessageType.TEXT, text=ai_response_text)]
-        assistant_message = await ChatService.add_message(
+        assistant_content = [{"type": MessageType.TEXT.value, "text": ai_response_text}]
+        assistant_message = ChatService.build_message(
             conversation_id=session_id,
             role=MessageRole.ASSISTANT,
             content=assistant_content
         )
 
+        # Store the image before the messages that reference it; drop it if they can't be saved
+        image_url = await ImageService.store_image_bytes(image_bytes, image_type, image_id)
+        try:
+            await ChatService.add_messages_bulk(session_id, [user_message, assistant_message])
+        except Exception:
+            await ImageService.delete_images([image_url])
+            raise
+
         return {
             "message_id": assistant_message["id"],
             "response": ai_response_text,
             "image_id": user_message["id"],
-            "image_preview": image_data[:100] + "..."  # Preview only
+            # Preview only, encoded from the first bytes instead of slicing the full data URL
+            "image_preview": f"data:{image_type};base64,{pybase64.b64encode(image_bytes[:75]).decode('ascii')}..."
         }
 
     except HTTPException:
@@ -337,29 +410,25 @@ async def send_image_message(
 
 @router.post("/chat/csv/suggestions")
 async def get_csv_suggestions(
+    http_request: Request,
     session_id: str = Form(...),
-    csv_file: UploadFile = File(...)
+    csv_file: UploadFile = Depends(require_csv_file)
 ):
     """
     Get suggested questions for a CSV file
     """
     try:
-        # Validate file type
-        if not csv_file.filename.endswith('.csv'):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Only CSV files are allowed"
-            )
-
         # Read and parse CSV
-        csv_bytes = await csv_file.read()
-        df = CSVService.load_csv_from_bytes(csv_bytes)
-
-        # Generate suggested questions
-        suggestions = CSVService.generate_suggested_questions(df)
-
-        # Get basic info for context
-        basic_info = CSVService.get_basic_info(df)
+        csv_bytes = await UploadService.read_upload(csv_file)
+        csv_service: CSVService = http_request.app.state.csv_service
+        df = await csv_service.parse_csv_bytes(csv_bytes)
+
+        # Generate suggested questions and basic info for context
+        # Both scan the whole frame, so they run in worker threads rather than on the event loop
+        suggestions, basic_info = await asyncio.gather(
+            asyncio.to_thread(CSVService.generate_suggested_questions, df),
+            asyncio.to_thread(CSVService.get_basic_info, df)
+        )
 
         return {
             "suggestions": suggestions,
@@ -375,22 +444,25 @@ async def get_csv_suggestions(
 
 @router.post("/chat/csv/upload")
 async def send_csv_message(
+    http_request: Request,
+    background_tasks: BackgroundTasks,
     session_id: str = Form(...),
     message: str = Form(...),
-    csv_file: Optional[UploadFile] = File(None),
+    csv_file: Optional[UploadFile] = Depends(optional_csv_file),
     csv_url: Optional[str] = Form(None)
 ):
     """
     Send a message with a CSV file or URL
     """
     try:
-        # Verify conversation exists
-        conversation = await ChatService.get_conversation(session_id)
+        # Verify conversation exists and load its history window in the same round trip
+        conversation = await ChatService.get_conversation_with_window(session_id)
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Session not found"
             )
+        history = conversation.pop("messages")
 
         # Ensure either csv_file or csv_url is provided
         if not csv_file and not csv_url:
@@ -399,97 +471,96 @@ async def send_csv_message(
                 detail="Either csv_file or csv_url must be provided"
             )
 
-        # Load CSV from file or URL
+        # Load CSV from file or URL through the shared, process-pool backed service
+        csv_service: CSVService = http_request.app.state.csv_service
         if csv_url:
             # Load CSV from URL
-            csv_service = CSVService()
             df = await csv_service.load_csv_from_url(csv_url)
-            await csv_service.close_session()
 
             # For URL, we'll store the URL itself for reference
             csv_filename = csv_url.split('/')[-1] or "data.csv"
-            csv_bytes = df.to_csv(index=False).encode('utf-8')
         else:
-            # Validate file type
-            if not csv_file.filename.endswith('.csv'):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Only CSV files are allowed"
-                )
-
             # Read and parse CSV from file
-            csv_bytes = await csv_file.read()
+            csv_bytes = await UploadService.read_upload(csv_file)
             csv_filename = csv_file.filename
-            df = CSVService.load_csv_from_bytes(csv_bytes)
+            df = await csv_service.parse_csv_bytes(csv_bytes)
 
-        # Store CSV data in conversation metadata for multi-turn support
-        csv_data_base64 = base64.b64encode(csv_bytes).decode('utf-8')
+        # Reference the CSV from conversation metadata for multi-turn support
         metadata_update = {
             "active_csv_filename": csv_filename,
-            "active_csv_data": csv_data_base64,
             "has_active_csv": True
         }
 
-        # Store URL if provided for easier reloading
+        # URL-based CSVs are reloaded from the URL; uploaded files are kept in GridFS
+        previous_csv_id = None
         if csv_url:
             metadata_update["active_csv_url"] = csv_url
+        else:
+            previous_csv_id = conversation.get("metadata", {}).get("active_csv_gridfs_id")
+            metadata_update["active_csv_gridfs_id"] = await CSVService.store_csv(csv_filename, csv_bytes, df)
+            metadata_update["active_csv_data"] = None  # Drop the base64 copy written by older versions
 
         await ChatService.update_conversation_metadata(
             conversation_id=session_id,
             metadata=metadata_update
         )
-
-        # Generate suggested questions for frontend
-        suggested_questions = CSVService.generate_suggested_questions(df)
-
-        # Analyze CSV
-        csv_service = CSVService()
-        csv_analysis = await csv_service.analyze_query(df, message, conversation_id=session_id)
-        await csv_service.close_session()
+        background_tasks.add_task(CSVService.delete_stored_csv, previous_csv_id)
+
+        # Analyze CSV; a new CSV replaces whatever SmartDataframe was cached for this session
+        # Suggested questions for the frontend are generated in a worker thread meanwhile
+        csv_service.clear_cache(session_id)
+        suggested_questions, csv_analysis = await asyncio.gather(
+            asyncio.to_thread(CSVService.generate_suggested_questions, df),
+            csv_service.analyze_query(df, message, conversation_id=session_id)
+        )
 
         # Check if visualization was generated
         visualization_image = None
         if csv_analysis.get("type") == "visualization" and csv_analysis.get("result", {}).get("image_data"):
             visualization_image = csv_analysis["result"]["image_data"]
 
-        # Save user message
+        # Build user message (stored together with the reply)
         csv_source = f"URL: {csv_url}" if csv_url else f"File: {csv_filename}"
         user_content = [
-            MessageContent(type=MessageType.TEXT, text=f"Uploaded CSV ({csv_source}). {message}"),
-            MessageContent(type=MessageType.CSV, csv_data=csv_analysis)
+            {"type": MessageType.TEXT.value, "text": f"Uploaded CSV ({csv_source}). {message}"},
+            {"type": MessageType.CSV.value, "csv_data": csv_analysis}
         ]
-        user_message = await ChatService.add_message(
+        user_message = ChatService.build_message(
             conversation_id=session_id,
             role=MessageRole.USER,
             content=user_content
         )
 
-        # Get conversation history
-        messages = await ChatService.get_messages(session_id, apply_sliding_window=True)
+        # Append the new user message to the history window loaded above
+        messages = ContextWindowService.apply_sliding_window(
+            history + [user_message],
+            total_messages=conversation.get("message_count", 0) + 1
+        )["messages"]
+        messages = await ImageService.resolve_stored_images(messages)
         formatted_messages = AIService.format_conversation_history(messages)
 
         # Generate AI response
         ai_response_text = await AIService.generate_response(
             formatted_messages,
-            AIService.create_system_prompt()
+            SYSTEM_PROMPT
         )
 
         # Save assistant message
-        assistant_content = [MessageContent(type=MessageType.TEXT, text=ai_response_text)]
+        assistant_content = [{"type": MessageType.TEXT.value, "text": ai_response_text}]
 
         # Add visualization image to assistant message if generated
         if visualization_image:
-            assistant_content.append(MessageContent(
-                type=MessageType.IMAGE,
-                image_url=visualization_image
-            ))
+            assistant_content.append({"type": MessageType.IMAGE.value, "image_url": visualization_image})
 
-        assistant_message = await ChatService.add_message(
+        assistant_message = ChatService.build_message(
             conversation_id=session_id,
             role=MessageRole.ASSISTANT,
             content=assistant_content
         )
 
+        # Save both messages of the turn in one round trip
+        await ChatService.add_messages_bulk(session_id, [user_message, assistant_message])
+
         return {
             "message_id": assistant_message["id"],
             "response": ai_response_text,
@@ -514,8 +585,6 @@ async def health_check():
     Health check endpoint for v2 API
     """
     try:
-        from database import MongoDB
-
         # Check database connection
         db = MongoDB.database
         if db is None:
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import ORJSONResponse
 from typing import List
 from models import (
     CreateConversationRequest,
@@ -6,6 +7,7 @@ from models import (
     MessageResponse
 )
 from services.chat_service import ChatService
+from services.image_service import ImageService
 from datetime import datetime
 
 router = APIRouter(prefix="/api/conversations", tags=["conversations"])
@@ -83,7 +85,7 @@ async def get_conversation(conversation_id: str):
 
 
 @router.delete("/{conversation_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_conversation(conversation_id: str):
+async def delete_conversation(conversation_id: str, request: Request):
     """Delete a conversation"""
     try:
         success = await ChatService.delete_conversation(conversation_id)
@@ -94,6 +96,9 @@ async def delete_conversation(conversation_id: str):
                 detail="Conversation not found"
             )
 
+        # Drop the conversation's SmartDataframe so its copy of the CSV is freed
+        request.app.state.csv_service.clear_cache(conversation_id)
+
         return None
     except HTTPException:
         raise
@@ -108,26 +113,20 @@ async def delete_conversation(conversation_id: str):
 async def get_messages(conversation_id: str, limit: int = 100):
     """Get all messages in a conversation"""
     try:
-        # Check if conversation exists
-        conversation = await ChatService.get_conversation(conversation_id)
+        # Existence check and messages in one round trip
+        conversation = await ChatService.get_conversation_with_messages(conversation_id, limit)
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Conversation not found"
             )
 
-        messages = await ChatService.get_messages(conversation_id, limit)
-
-        return [
-            MessageResponse(
-                id=msg["id"],
-                conversation_id=msg["conversation_id"],
-                role=msg["role"],
-                content=msg["content"],
-                timestamp=msg["timestamp"]
-            )
-            for msg in messages
-        ]
+        # Returned as a response directly: with response_model FastAPI would dump and
+        # re-validate every message (payloads included) after from_document skipped that
+        return ORJSONResponse(content=[
+            MessageResponse.from_document(ImageService.with_public_image_urls(msg)).model_dump()
+            for msg in conversation["messages"]
+        ])
     except HTTPException:
         raise
     except Exception as e:
@@ -0,0 +1,55 @@
+"""
+Request dependencies shared by the chat routers
+Resolved before the handler body runs, so bad uploads are rejected up front
+"""
+
+from typing import Optional
+from bson import ObjectId
+from fastapi import File, HTTPException, Query, UploadFile, status
+
+
+def _check_csv_filename(file: UploadFile) -> UploadFile:
+    """Reject uploads that aren't .csv files (case-insensitive)"""
+    if not (file.filename or "").lower().endswith(".csv"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only CSV files are allowed"
+        )
+    return file
+
+
+def require_csv_upload(file: UploadFile = File(...)) -> UploadFile:
+    """CSV upload sent in the "file" form field (v1)"""
+    return _check_csv_filename(file)
+
+
+def require_csv_file(csv_file: UploadFile = File(...)) -> UploadFile:
+    """CSV upload sent in the "csv_file" form field (v2)"""
+    return _check_csv_filename(csv_file)
+
+
+def optional_csv_file(csv_file: Optional[UploadFile] = File(None)) -> Optional[UploadFile]:
+    """Optional CSV upload sent in the "csv_file" form field (v2)"""
+    return _check_csv_filename(csv_file) if csv_file else None
+
+
+def valid_session_id(session_id: str) -> str:
+    """Session id path parameter; malformed ids are answered with 404 without touching MongoDB"""
+    if not ObjectId.is_valid(session_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
+    return session_id
+
+
+def optional_message_id(before_id: Optional[str] = Query(None)) -> Optional[ObjectId]:
+    """Message id query parameter of a keyset page cursor; malformed ids are answered with 400"""
+    if before_id is None:
+        return None
+    if not ObjectId.is_valid(before_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid before_id"
+        )
+    return ObjectId(before_id)
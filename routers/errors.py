@@ -0,0 +1,25 @@
+"""
+Error translation shared by the routers
+Unexpected exceptions become 500 responses; HTTPExceptions pass through unchanged
+"""
+
+import functools
+from fastapi import HTTPException, status
+
+
+def wrap_errors(message: str):
+    """Turn unexpected exceptions raised by a route into a 500 "<message>: <error>" response"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"{message}: {str(e)}"
+                ) from e
+        return wrapper
+    return decorator
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import Response
+from services.image_service import ImageService
+
+router = APIRouter(prefix="/api/images", tags=["images"])
+
+
+@router.get("/{image_id}")
+async def get_image(image_id: str):
+    """
+    Get a stored image by id
+    Messages reference stored images as gridfs://{image_id}
+    """
+    try:
+        image_bytes, content_type = await ImageService.load_image(image_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found"
+        )
+
+    return Response(
+        content=image_bytes,
+        media_type=content_type,
+        headers={
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "Content-Encoding": "identity"  # Already compressed formats; GZipMiddleware skips them
+        }
+    )
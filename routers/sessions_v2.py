@@ -1,14 +1,26 @@
-from fastapi import APIRouter, HTTPException, status, Query
-from fastapi.responses import PlainTextResponse, JSONResponse
-from typing import Optional, List
-from models import ConversationResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from typing import Any, Dict, Optional, List, Tuple
+from collections import OrderedDict
+import orjson
+from models import ConversationResponse, SessionBatchRequest
+from routers.dependencies import optional_message_id, valid_session_id
+from routers.errors import wrap_errors
 from services.chat_service import ChatService
 from datetime import datetime
+from bson import ObjectId
 
 router = APIRouter(prefix="/api/v2/sessions", tags=["sessions-v2"])
 
+# Encoded GET /{session_id} bodies: session id -> (conversation they were built from, JSON).
+# Reused while ChatService keeps returning that same cached conversation; any write
+# replaces the conversation, so a stale body is never served.
+_encoded_sessions: "OrderedDict[str, Tuple[Dict[str, Any], bytes]]" = OrderedDict()
+MAX_ENCODED_SESSIONS = 256
+
 
 @router.post("/create", status_code=status.HTTP_201_CREATED)
+@wrap_errors("Failed to create session")
 async def create_session(
     user_id: Optional[str] = Query(None),
     title: Optional[str] = Query("New Conversation")
@@ -17,228 +29,208 @@ async def create_session(
     Create a new chat session
     Returns session_id, created_at, and message
     """
-    try:
-        conversation = await ChatService.create_conversation(title)
+    conversation = await ChatService.create_conversation(title)
 
-        return {
-            "session_id": conversation["id"],
-            "created_at": conversation["created_at"].isoformat(),
-            "message": "Session created successfully"
-        }
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to create session: {str(e)}"
-        )
+    return {
+        "session_id": conversation["id"],
+        "created_at": conversation["created_at"].isoformat(),
+        "message": "Session created successfully"
+    }
 
 
 @router.get("/{session_id}")
-async def get_session(session_id: str):
+@wrap_errors("Failed to get session")
+async def get_session(session_id: str = Depends(valid_session_id)):
     """
     Get session details with messages
     """
-    try:
-        conversation = await ChatService.get_conversation(session_id)
+    # Session and its messages in one round trip, rendered for the response by MongoDB
+    conversation = await ChatService.get_conversation_with_messages(session_id, display=True)
 
-        if not conversation:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Session not found"
-            )
-
-        # Get messages for the session
-        messages = await ChatService.get_messages(session_id)
-
-        return {
-            "session_id": conversation["id"],
-            "created_at": conversation["created_at"].isoformat(),
-            "updated_at": conversation.get("updated_at", conversation["created_at"]).isoformat(),
-            "message_count": conversation["message_count"],
-            "messages": [
-                {
-                    "role": msg["role"],
-                    "content": msg["content"][0]["text"] if msg["content"] and msg["content"][0].get("text") else "",
-                    "timestamp": msg["timestamp"].isoformat(),
-                    "metadata": {}
-                }
-                for msg in messages
-            ]
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
+    if not conversation:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to get session: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
         )
 
+    cached = _encoded_sessions.get(session_id)
+    if cached is not None and cached[0] is conversation:
+        _encoded_sessions.move_to_end(session_id)
+        body = cached[1]
+    else:
+        body = orjson.dumps(_session_payload(conversation))
+        _encoded_sessions[session_id] = (conversation, body)
+        _encoded_sessions.move_to_end(session_id)
+        if len(_encoded_sessions) > MAX_ENCODED_SESSIONS:
+            _encoded_sessions.popitem(last=False)
+
+    return Response(content=body, media_type="application/json")
+
+
+@router.post("/batch")
+@wrap_errors("Failed to get sessions")
+async def get_sessions_batch(request: SessionBatchRequest):
+    """
+    Get several sessions with their messages in one call
+    Sessions are loaded with a single query; unknown ids are left out
+    """
+    conversations = await ChatService.get_conversations_with_messages(request.session_ids, display=True)
+
+    return {"sessions": [_session_payload(conversation) for conversation in conversations]}
+
+
+def _session_payload(conversation: dict) -> dict:
+    """Session response body for a conversation loaded with display=True"""
+    return {
+        "session_id": conversation["id"],
+        "created_at": conversation["created_at"].isoformat(),
+        "updated_at": conversation.get("updated_at", conversation["created_at"]).isoformat(),
+        "message_count": conversation["message_count"],
+        "messages": conversation["messages"]
+    }
+
 
 @router.delete("/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_session(session_id: str):
+@wrap_errors("Failed to delete session")
+async def delete_session(request: Request, session_id: str = Depends(valid_session_id)):
     """
     Delete a session
     """
-    try:
-        success = await ChatService.delete_conversation(session_id)
+    success = await ChatService.delete_conversation(session_id)
 
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Session not found"
-            )
-
-        return None
-    except HTTPException:
-        raise
-    except Exception as e:
+    if not success:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to delete session: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
         )
 
+    # Drop the session's SmartDataframe so its copy of the CSV is freed
+    request.app.state.csv_service.clear_cache(session_id)
+    _encoded_sessions.pop(session_id, None)
+
+    return None
+
 
 @router.get("/{session_id}/stats")
-async def get_session_stats(session_id: str):
+@wrap_errors("Failed to get stats")
+async def get_session_stats(session_id: str = Depends(valid_session_id)):
     """
     Get context statistics for a session with sliding window info
     """
-    try:
-        conversation = await ChatService.get_conversation(session_id)
-
-        if not conversation:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Session not found"
-            )
+    # Get context summary with sliding window info; messages, roles and tokens are counted by MongoDB
+    context_summary = await ChatService.get_context_summary(session_id)
 
-        # Get context summary with sliding window info
-        context_summary = await ChatService.get_context_summary(session_id)
-
-        messages = await ChatService.get_messages(session_id)
-        user_messages = sum(1 for msg in messages if msg["role"] == "user")
-        assistant_messages = sum(1 for msg in messages if msg["role"] == "assistant")
-
-        return {
-            "total_messages": context_summary["total_messages"],
-            "total_tokens": context_summary["estimated_tokens"],
-            "max_messages": context_summary.get("max_messages", 20),
-            "max_tokens": context_summary.get("token_limit", 100000),
-            "needs_optimization": context_summary["needs_optimization"],
-            "within_limits": context_summary["within_limits"],
-            "token_usage_percent": round(context_summary.get("token_usage_percent", 0), 2),
-            "message_usage_percent": round(context_summary.get("message_usage_percent", 0), 2),
-            "user_messages": user_messages,
-            "assistant_messages": assistant_messages,
-            "system_messages": 0,
-            "messages_in_db": len(messages),
-            "sliding_window_enabled": True
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
+    if context_summary is None:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to get stats: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
         )
+    role_counts = context_summary["role_counts"]
+
+    return {
+        "total_messages": context_summary["total_messages"],
+        "total_tokens": context_summary["estimated_tokens"],
+        "max_messages": context_summary.get("max_messages", 20),
+        "max_tokens": context_summary.get("token_limit", 100000),
+        "needs_optimization": context_summary["needs_optimization"],
+        "within_limits": context_summary["within_limits"],
+        "token_usage_percent": round(context_summary.get("token_usage_percent", 0), 2),
+        "message_usage_percent": round(context_summary.get("message_usage_percent", 0), 2),
+        "user_messages": role_counts.get("user", 0),
+        "assistant_messages": role_counts.get("assistant", 0),
+        "system_messages": role_counts.get("system", 0),
+        "messages_in_db": sum(role_counts.values()),
+        "sliding_window_enabled": True
+    }
 
 
 @router.get("/{session_id}/context")
+@wrap_errors("Failed to get context")
 async def get_optimized_context(
-    session_id: str,
+    session_id: str = Depends(valid_session_id),
     max_messages: Optional[int] = Query(None),
-    preserve_first: Optional[int] = Query(None)
+    preserve_first: Optional[int] = Query(None),
+    before: Optional[datetime] = Query(None),
+    before_id: Optional[ObjectId] = Depends(optional_message_id)
 ):
     """
     Get optimized context for a session with sliding window applied
+    Pass `before` and `before_id` (the timestamp and id of the oldest message
+    returned) to page back through older messages
     """
-    try:
-        conversation = await ChatService.get_conversation(session_id)
-
-        if not conversation:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Session not found"
-            )
-
-        # Get optimized context with sliding window
-        result = await ChatService.get_optimized_context(
-            session_id,
-            max_messages=max_messages,
-            preserve_first=preserve_first
-        )
-
-        return {
-            "session_id": session_id,
-            "strategy": "sliding_window",
-            "total_messages": result["total_messages"],
-            "kept_messages": result["kept_messages"],
-            "removed_messages": result["removed_messages"],
-            "estimated_tokens": result["estimated_tokens"],
-            "window_applied": result["window_applied"],
-            "preserved_count": result.get("preserved_count", 0),
-            "messages": [
-                {
-                    "role": msg["role"],
-                    "content": msg["content"][0]["text"] if msg["content"] and msg["content"][0].get("text") else "",
-                    "timestamp": msg["timestamp"].isoformat(),
-                    "metadata": {}
-                }
-                for msg in result["messages"]
-            ]
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
+    # Get optimized context with sliding window
+    result = await ChatService.get_optimized_context(
+        session_id,
+        max_messages=max_messages,
+        preserve_first=preserve_first,
+        iso_timestamps=True,
+        before=before,
+        before_id=before_id
+    )
+
+    if result is None:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to get context: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
         )
 
+    return {
+        "session_id": session_id,
+        "strategy": "sliding_window",
+        "total_messages": result["total_messages"],
+        "kept_messages": result["kept_messages"],
+        "removed_messages": result["removed_messages"],
+        "estimated_tokens": result["estimated_tokens"],
+        "window_applied": result["window_applied"],
+        "preserved_count": result.get("preserved_count", 0),
+        "messages": [
+            {
+                "id": msg["id"],
+                "role": msg["role"],
+                "content": ChatService.display_text(msg),
+                "timestamp": msg["timestamp"],  # Formatted by MongoDB
+                "metadata": {}
+            }
+            for msg in result["messages"]
+        ]
+    }
+
 
 @router.get("/{session_id}/export")
+@wrap_errors("Failed to export conversation")
 async def export_conversation(
-    session_id: str,
+    session_id: str = Depends(valid_session_id),
     format: str = Query("json", regex="^(json|markdown|text)$")
 ):
     """
     Export conversation in different formats
     Supported formats: json, markdown, text
     """
-    try:
-        conversation = await ChatService.get_conversation(session_id)
-
-        if not conversation:
+    if format == "json":
+        # export_conversation loads the conversation itself and raises if it doesn't exist
+        try:
+            export_data = await ChatService.export_conversation(session_id, format)
+        except ValueError:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Session not found"
             )
+        return ORJSONResponse(content=export_data)
 
-        export_data = await ChatService.export_conversation(session_id, format)
-
-        # Return appropriate response based on format
-        if format == "json":
-            return JSONResponse(content=export_data)
-        elif format == "markdown":
-            return PlainTextResponse(
-                content=export_data["content"],
-                media_type="text/markdown",
-                headers={
-                    "Content-Disposition": f"attachment; filename=conversation_{session_id}.md"
-                }
-            )
-        elif format == "text":
-            return PlainTextResponse(
-                content=export_data["content"],
-                media_type="text/plain",
-                headers={
-                    "Content-Disposition": f"attachment; filename=conversation_{session_id}.txt"
-                }
-            )
-
-    except HTTPException:
-        raise
-    except Exception as e:
+    conversation = await ChatService.get_conversation(session_id)
+    if not conversation:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to export conversation: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
         )
+
+    # Markdown and text are rendered and sent one message at a time
+    media_type, extension = ("text/markdown", "md") if format == "markdown" else ("text/plain", "txt")
+    return StreamingResponse(
+        ChatService.iter_export(conversation, format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename=conversation_{session_id}.{extension}"
+        }
+    )
+
@@ -1,58 +1,150 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
 from config import settings
-import json
+import asyncio
+import orjson
 import base64
 import hashlib
 import logging
+import time
 from functools import lru_cache
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from services.image_service import ImageService
 
 logger = logging.getLogger(__name__)
 
-# Simple in-memory cache for responses (use Redis in production)
-_response_cache: Dict[str, str] = {}
+# In-memory LRU of responses: key -> (response, stored at); use Redis in production
+_response_cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
 MAX_CACHE_SIZE = 1000
+CACHE_TTL_SECONDS = 3600
+
+# Completions currently being generated, by cache key, so identical concurrent
+# requests share one OpenAI call instead of all missing the cache
+_in_flight: Dict[str, "asyncio.Task[Optional[str]]"] = {}
+
+# Pretty-printed JSON for CSV context; column names in records may not be strings
+_CONTEXT_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+# Formatted CSV context per stored content item: (message _id, item index) -> text.
+# Stored messages never change, so entries need no TTL.
+_csv_context_cache: "OrderedDict[Tuple[Any, int], str]" = OrderedDict()
+MAX_CSV_CONTEXT_CACHE_SIZE = 256
+
+# Static, so it is built once at import instead of per request
+SYSTEM_PROMPT = """You are a helpful AI assistant integrated into a chat application.
+
+You can:
+1. Have multi-turn conversations with users
+2. Analyze and discuss images that users upload
+3. Analyze CSV data and answer questions about datasets
+4. Generate data visualizations (charts, plots, graphs) for CSV data
+5. Help with data analysis tasks like summarizing data, computing statistics, and identifying patterns
+
+CRITICAL RULES FOR CSV DATA:
+- When a user says "Uploaded CSV (URL: ...)" or "Uploaded CSV (File: ...)" - THE DATA HAS ALREADY BEEN LOADED
+- You WILL ALWAYS receive "CSV Data Analysis:" in the message content with the full dataset details
+- The system has ALREADY fetched the URL or file - you DON'T need to access anything
+- NEVER say "I cannot access URLs" or "please upload the file" - THE DATA IS ALREADY IN YOUR CONTEXT
+- Simply analyze the data provided in the "CSV Data Analysis:" section
+
+Example of what you'll see:
+User: "Uploaded CSV (URL: https://example.com/data.csv). Summarize this dataset"
+[Your context will include]: "CSV Data Analysis: Dataset: 150 rows × 5 columns..."
+
+Your response should be: "Based on the dataset provided, here's the summary: ..." (NOT "I cannot access the URL")
+
+IMPORTANT FOR VISUALIZATIONS:
+- When you see "[A visualization image has been generated and will be displayed to the user]", a chart has been created
+- Acknowledge the visualization and provide insights about what it shows
+- The visualization is automatically shown to the user - focus on interpretation
+
+When discussing images, be specific about what you observe.
+When analyzing CSV data, provide clear, actionable insights based on the data you received.
+Be concise but informative in your responses."""
+
+# OpenAI message for SYSTEM_PROMPT, shared by every request (never mutated)
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
 
 
 class AIService:
     """Service for OpenAI GPT interactions with caching"""
 
-    _client: Optional[OpenAI] = None
+    _client: Optional[AsyncOpenAI] = None
     _client_lock = None
 
     @classmethod
-    def get_client(cls) -> OpenAI:
-        """Get or create OpenAI client (singleton pattern)"""
+    def get_client(cls) -> AsyncOpenAI:
+        """Get or create the async OpenAI client (singleton pattern)"""
         if cls._client is None:
             if not settings.openai_api_key:
                 raise ValueError("OPENAI_API_KEY not set in environment")
-            cls._client = OpenAI(
+            cls._client = AsyncOpenAI(
                 api_key=settings.openai_api_key,
                 timeout=30.0,  # Request timeout
                 max_retries=2,  # Retry failed requests
+                # Pooled keep-alive connections shared by all concurrent requests
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+                ),
             )
             logger.info("OpenAI client initialized")
         return cls._client
 
+    @classmethod
+    async def close_client(cls):
+        """Close the client's connection pool (on shutdown)"""
+        if cls._client is not None:
+            await cls._client.close()
+            cls._client = None
+
     @staticmethod
     def _generate_cache_key(messages: List[Dict[str, Any]], system_prompt: Optional[str]) -> str:
-        """Generate a cache key for the request"""
-        # Create a hash of the messages and system prompt
-        content = json.dumps(messages, sort_keys=True) + (system_prompt or "")
-        return hashlib.md5(content.encode()).hexdigest()
+        """
+        Generate a cache key for the request
+        Hashes the model, system prompt and conversation one message at a time,
+        so no JSON string of the whole conversation (images included) is built.
+        Image data URLs are fed to the hasher as-is instead of through JSON.
+        """
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(orjson.dumps([settings.openai_model, system_prompt or ""]))
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, str):
+                hasher.update(orjson.dumps([message["role"], content]))
+                continue
+
+            hasher.update(orjson.dumps([message["role"], len(content)]))
+            for part in content:
+                if part.get("type") == "image_url":
+                    url = part["image_url"]["url"].encode()
+                    # Length-prefixed so the raw URL can't run into the next part
+                    hasher.update(b"I%d:" % len(url))
+                    hasher.update(url)
+                else:
+                    hasher.update(orjson.dumps(part, option=orjson.OPT_SORT_KEYS))
+        return hasher.hexdigest()
 
     @staticmethod
     def _get_cached_response(cache_key: str) -> Optional[str]:
-        """Get cached response if available"""
-        return _response_cache.get(cache_key)
+        """Get cached response if available and not expired"""
+        cached = _response_cache.get(cache_key)
+        if cached is None:
+            return None
+        response, stored_at = cached
+        if time.monotonic() - stored_at > CACHE_TTL_SECONDS:
+            del _response_cache[cache_key]
+            return None
+        _response_cache.move_to_end(cache_key)
+        return response
 
     @staticmethod
     def _cache_response(cache_key: str, response: str):
         """Cache a response (with size limit)"""
-        if len(_response_cache) >= MAX_CACHE_SIZE:
-            # Simple LRU: remove first item
-            _response_cache.pop(next(iter(_response_cache)))
-        _response_cache[cache_key] = response
+        _response_cache[cache_key] = (response, time.monotonic())
+        _response_cache.move_to_end(cache_key)
+        if len(_response_cache) > MAX_CACHE_SIZE:
+            _response_cache.popitem(last=False)
 
     @staticmethod
     def format_conversation_history(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -60,63 +152,79 @@ class AIService:
         formatted = []
 
         for msg in messages:
-            role = msg.get("role", "user")
-            content_list = msg.get("content", [])
+            # Anything that isn't a user message is sent as the assistant
+            is_user = msg.get("role", "user") == "user"
+            role = "user" if is_user else "assistant"
+            content_list = msg.get("content") or ()
+
+            # Most messages are a single text item, which is sent as a plain string
+            if len(content_list) == 1 and content_list[0].get("type") == "text":
+                text = content_list[0].get("text")
+                if text:
+                    formatted.append({"role": role, "content": text})
+                continue
 
             # Build content for this message
             message_content = []
 
-            for content_item in content_list:
+            for index, content_item in enumerate(content_list):
                 content_type = content_item.get("type")
 
-                if content_type == "text" and content_item.get("text"):
-                    message_content.append({
-                        "type": "text",
-                        "text": content_item["text"]
-                    })
+                if content_type == "text":
+                    text = content_item.get("text")
+                    if text:
+                        message_content.append({"type": "text", "text": text})
 
-                elif content_type == "image" and content_item.get("image_url"):
+                elif content_type == "image":
                     # IMPORTANT: OpenAI API only allows images in user messages, not assistant messages
                     # Skip images in assistant messages to avoid API errors
-                    if role == "user":
+                    # Stored images (gridfs://) must be resolved to data URLs beforehand
+                    # with ImageService.resolve_stored_images; skip any that weren't
+                    image_data = content_item.get("image_url") if is_user else None
+                    if image_data and not ImageService.is_stored_image(image_data):
                         # OpenAI expects image_url format
-                        image_data = content_item["image_url"]
-
-                        # Ensure proper format
                         if not image_data.startswith("data:image"):
                             image_data = f"data:image/jpeg;base64,{image_data}"
+                        message_content.append({"type": "image_url", "image_url": {"url": image_data}})
 
-                        message_content.append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_data
-                            }
-                        })
-                    # If it's an assistant message with an image, skip the image but keep processing other content
-
-                elif content_type == "csv" and content_item.get("csv_data"):
-                    # Format CSV data as text context
-                    csv_text = AIService._format_csv_for_context(content_item["csv_data"])
-                    message_content.append({
-                        "type": "text",
-                        "text": csv_text
-                    })
-
-            if message_content:
-                # If only one text content, simplify
-                if len(message_content) == 1 and message_content[0]["type"] == "text":
-                    formatted.append({
-                        "role": "user" if role == "user" else "assistant",
-                        "content": message_content[0]["text"]
-                    })
-                else:
-                    formatted.append({
-                        "role": "user" if role == "user" else "assistant",
-                        "content": message_content
-                    })
+                elif content_type == "csv":
+                    csv_data = content_item.get("csv_data")
+                    if csv_data:
+                        # Format CSV data as text context
+                        csv_text = AIService._format_csv_cached(msg.get("_id"), index, csv_data)
+                        message_content.append({"type": "text", "text": csv_text})
+
+            if not message_content:
+                continue
+
+            # If only one text content, simplify
+            if len(message_content) == 1 and message_content[0]["type"] == "text":
+                formatted.append({"role": role, "content": message_content[0]["text"]})
+            else:
+                formatted.append({"role": role, "content": message_content})
 
         return formatted
 
+    @staticmethod
+    def _format_csv_cached(message_id: Any, index: int, csv_data: Dict[str, Any]) -> str:
+        """
+        Format a message's CSV item once and reuse the text on later turns
+        The same analysis is re-sent with every turn while it stays in the window.
+        """
+        if message_id is None:
+            return AIService._format_csv_for_context(csv_data)
+
+        key = (message_id, index)
+        csv_text = _csv_context_cache.get(key)
+        if csv_text is None:
+            csv_text = AIService._format_csv_for_context(csv_data)
+            _csv_context_cache[key] = csv_text
+            if len(_csv_context_cache) > MAX_CSV_CONTEXT_CACHE_SIZE:
+                _csv_context_cache.popitem(last=False)
+        else:
+            _csv_context_cache.move_to_end(key)
+        return csv_text
+
     @staticmethod
     def _format_csv_for_context(csv_data: Dict[str, Any]) -> str:
         """Format CSV analysis data for AI context"""
@@ -144,15 +252,7 @@ class AIService:
             if result_data.get("stats"):
                 stats_data = result_data["stats"]
                 if stats_data.get("statistics"):
-                    parts.append("\nStatistical Summary:")
-                    for col, stats in stats_data["statistics"].items():
-                        parts.append(f"\n{col}:")
-                        if isinstance(stats, dict):
-                            for stat_name, value in stats.items():
-                                if isinstance(value, (int, float)):
-                                    parts.append(f"  - {stat_name}: {value:.2f}")
-                                else:
-                                    parts.append(f"  - {stat_name}: {value}")
+                    AIService._append_statistics(parts, stats_data["statistics"])
 
             if result_data.get("missing"):
                 missing_data = result_data["missing"]
@@ -167,21 +267,13 @@ class AIService:
         elif response_type == "statistics":
             # Statistics response
             if result_data.get("statistics"):
-                parts.append("\nStatistical Summary:")
-                for col, stats in result_data["statistics"].items():
-                    parts.append(f"\n{col}:")
-                    if isinstance(stats, dict):
-                        for stat_name, value in stats.items():
-                            if isinstance(value, (int, float)):
-                                parts.append(f"  - {stat_name}: {value:.2f}")
-                            else:
-                                parts.append(f"  - {stat_name}: {value}")
+                AIService._append_statistics(parts, result_data["statistics"])
 
         elif response_type == "preview":
             # Preview response
             if result_data.get("data"):
                 parts.append(f"\nData Preview ({result_data.get('rows', 0)} rows):")
-                parts.append(json.dumps(result_data["data"], indent=2))
+                parts.append(orjson.dumps(result_data["data"], default=str, option=_CONTEXT_JSON_OPTIONS).decode())
 
         elif response_type == "histogram":
             # Histogram response
@@ -249,7 +341,7 @@ class AIService:
         else:
             # Generic fallback - just dump the result
             parts.append(f"\nResult Data:")
-            parts.append(json.dumps(result_data, indent=2, default=str))
+            parts.append(orjson.dumps(result_data, default=str, option=_CONTEXT_JSON_OPTIONS).decode())
 
         # Add metadata if available
         if csv_data.get("metadata"):
@@ -261,6 +353,32 @@ class AIService:
 
         return "\n".join(parts)
 
+    @staticmethod
+    def _append_statistics(parts: List[str], statistics: Dict[str, Any]):
+        """Append a per-column statistics section, numbers to two decimals"""
+        append = parts.append
+        append("\nStatistical Summary:")
+        for col, stats in statistics.items():
+            append(f"\n{col}:")
+            if isinstance(stats, dict):
+                for stat_name, value in stats.items():
+                    if isinstance(value, (int, float)):
+                        append("  - %s: %.2f" % (stat_name, value))
+                    else:
+                        append(f"  - {stat_name}: {value}")
+
+    @staticmethod
+    def _with_system_prompt(messages: List[Dict[str, Any]], system_prompt: Optional[str]) -> List[Dict[str, Any]]:
+        """Prepend the system message to the conversation history"""
+        if not system_prompt:
+            return list(messages)
+        # The shared prompt's message is prebuilt; any other prompt gets its own
+        system_message = _SYSTEM_MESSAGE if system_prompt is SYSTEM_PROMPT else {
+            "role": "system",
+            "content": system_prompt
+        }
+        return [system_message, *messages]
+
     @staticmethod
     async def generate_response(
         messages: List[Dict[str, Any]],
@@ -277,66 +395,83 @@ class AIService:
                     logger.info(f"Cache hit for request")
                     return cached_response
 
-            client = AIService.get_client()
-
             # Prepare messages for OpenAI
-            openai_messages = []
+            openai_messages = AIService._with_system_prompt(messages, system_prompt)
+
+            if not use_cache:
+                return await AIService._complete(openai_messages)
+
+            # Join an identical request that is already waiting on OpenAI, or start one.
+            # The call runs as its own task and is shielded, so a caller that goes
+            # away doesn't cancel it for the others.
+            task = _in_flight.get(cache_key)
+            if task is None:
+                task = asyncio.ensure_future(AIService._complete(openai_messages, cache_key))
+                _in_flight[cache_key] = task
+                task.add_done_callback(lambda done: AIService._forget_in_flight(cache_key, done))
+            else:
+                logger.info(f"Joining in-flight request")
+            return await asyncio.shield(task)
 
-            # Add system prompt if provided
-            if system_prompt:
-                openai_messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            # Fallback response if API fails
+            return f"I apologize, but I encountered an error: {str(e)}. Please check your API key and try again."
 
-            # Add conversation history
-            openai_messages.extend(messages)
+    @staticmethod
+    async def _complete(openai_messages: List[Dict[str, Any]], cache_key: Optional[str] = None) -> Optional[str]:
+        """Call the OpenAI API and cache the response under cache_key"""
+        client = AIService.get_client()
 
-            # Call OpenAI API
-            response = client.chat.completions.create(
-                model=settings.openai_model,
-                messages=openai_messages,
-                max_tokens=1024,
-                temperature=0.7
-            )
+        # Call OpenAI API
+        response = await client.chat.completions.create(
+            model=settings.openai_model,
+            messages=openai_messages,
+            max_tokens=1024,
+            temperature=0.7
+        )
 
-            response_text = response.choices[0].message.content
+        response_text = response.choices[0].message.content
 
-            # Cache the response
-            if use_cache and response_text:
-                AIService._cache_response(cache_key, response_text)
+        # Cache the response
+        if cache_key and response_text:
+            AIService._cache_response(cache_key, response_text)
 
-            return response_text
+        return response_text
 
-        except Exception as e:
-            logger.error(f"OpenAI API error: {str(e)}")
-            # Fallback response if API fails
-            return f"I apologize, but I encountered an error: {str(e)}. Please check your API key and try again."
+    @staticmethod
+    def _forget_in_flight(cache_key: str, task: asyncio.Task):
+        """Done callback of an in-flight completion"""
+        if _in_flight.get(cache_key) is task:
+            del _in_flight[cache_key]
+        # Mark a failure as retrieved in case every caller has gone away
+        if not task.cancelled():
+            task.exception()
 
     @staticmethod
     async def generate_response_stream(
         messages: List[Dict[str, Any]],
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True
     ):
-        """Generate AI response with streaming using OpenAI GPT-4o-mini"""
+        """Generate AI response with streaming using OpenAI GPT-4o-mini, sharing the response cache"""
         try:
+            # Replay a cached response as a single chunk
+            if use_cache:
+                cache_key = AIService._generate_cache_key(messages, system_prompt)
+                cached_response = AIService._get_cached_response(cache_key)
+                if cached_response:
+                    logger.info(f"Cache hit for request")
+                    yield cached_response
+                    return
+
             client = AIService.get_client()
 
             # Prepare messages for OpenAI
-            openai_messages = []
-
-            # Add system prompt if provided
-            if system_prompt:
-                openai_messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
-
-            # Add conversation history
-            openai_messages.extend(messages)
+            openai_messages = AIService._with_system_prompt(messages, system_prompt)
 
             # Call OpenAI API with streaming
-            stream = client.chat.completions.create(
+            stream = await client.chat.completions.create(
                 model=settings.openai_model,
                 messages=openai_messages,
                 max_tokens=1024,
@@ -345,9 +480,19 @@ class AIService:
             )
 
             # Yield chunks as they arrive
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            chunks = []
+            try:
+                async for chunk in stream:
+                    if chunk.choices[0].delta.content is not None:
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            finally:
+                # Release the HTTP connection when the consumer stops early
+                await stream.close()
+
+            # Cache the complete response
+            if use_cache and chunks:
+                AIService._cache_response(cache_key, "".join(chunks))
 
         except Exception as e:
             # Yield error message
@@ -356,33 +501,4 @@ class AIService:
     @staticmethod
     def create_system_prompt() -> str:
         """Create system prompt for the AI"""
-        return """You are a helpful AI assistant integrated into a chat application.
-
-You can:
-1. Have multi-turn conversations with users
-2. Analyze and discuss images that users upload
-3. Analyze CSV data and answer questions about datasets
-4. Generate data visualizations (charts, plots, graphs) for CSV data
-5. Help with data analysis tasks like summarizing data, computing statistics, and identifying patterns
-
-CRITICAL RULES FOR CSV DATA:
-- When a user says "Uploaded CSV (URL: ...)" or "Uploaded CSV (File: ...)" - THE DATA HAS ALREADY BEEN LOADED
-- You WILL ALWAYS receive "CSV Data Analysis:" in the message content with the full dataset details
-- The system has ALREADY fetched the URL or file - you DON'T need to access anything
-- NEVER say "I cannot access URLs" or "please upload the file" - THE DATA IS ALREADY IN YOUR CONTEXT
-- Simply analyze the data provided in the "CSV Data Analysis:" section
-
-Example of what you'll see:
-User: "Uploaded CSV (URL: https://example.com/data.csv). Summarize this dataset"
-[Your context will include]: "CSV Data Analysis: Dataset: 150 rows × 5 columns..."
-
-Your response should be: "Based on the dataset provided, here's the summary: ..." (NOT "I cannot access the URL")
-
-IMPORTANT FOR VISUALIZATIONS:
-- When you see "[A visualization image has been generated and will be displayed to the user]", a chart has been created
-- Acknowledge the visualization and provide insights about what it shows
-- The visualization is automatically shown to the user - focus on interpretation
-
-When discussing images, be specific about what you observe.
-When analyzing CSV data, provide clear, actionable insights based on the data you received.
-Be concise but informative in your responses."""
+        return SYSTEM_PROMPT
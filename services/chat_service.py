@@ -1,13 +1,39 @@
-from typing import List, Optional, Dict, Any
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple, Union
+from collections import OrderedDict
 from datetime import datetime
 from bson import ObjectId
 from database import MongoDB
-from models import Message, Conversation, MessageRole, MessageType, MessageContent
+from models import MessageRole, MessageContent, utc_now
 from services.context_window import ContextWindowService
+from services.csv_service import CSVService
+from services.image_service import ImageService, STORED_IMAGE_PREFIX
+from config import settings
+import asyncio
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# In-memory read-through cache of session reads: conversation id -> {query options: (result, stored at)}
+# Every conversation write goes through ChatService and evicts the entry. The cache is per worker:
+# writes handled by another worker are only seen once the TTL passes (use Redis with several workers)
+_session_cache: "OrderedDict[str, Dict[Tuple[Any, ...], Tuple[Dict[str, Any], float]]]" = OrderedDict()
+MAX_SESSION_CACHE_SIZE = 256
+SESSION_CACHE_TTL_SECONDS = 60
+
+# Session reads in progress: conversation id -> [readers, writes seen since the first of them started].
+# A read that overlapped a write doesn't cache what it read; entries go away with their last reader.
+_session_reads: Dict[str, List[int]] = {}
+
+# Conversation updates running after their messages were inserted (referenced so they aren't collected)
+_background_writes: Set[asyncio.Task] = set()
+
+# Conversation fields a listing needs; metadata can hold a whole legacy inline CSV
+CONVERSATION_SUMMARY_FIELDS = {"title": 1, "created_at": 1, "updated_at": 1, "message_count": 1}
+
+# Message fields the sliding window and context views read; images only need their type, not the payload
+WINDOW_FIELDS = ("role", "timestamp", "text", "token_count", "content.type", "content.text", "content.csv_data")
+
 
 class ChatService:
     """Service for managing chat conversations and messages"""
@@ -17,10 +43,11 @@ class ChatService:
         """Create a new conversation"""
         collection = MongoDB.get_collection("conversations")
 
+        now = utc_now()
         conversation = {
             "title": title,
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
+            "created_at": now,
+            "updated_at": now,
             "message_count": 0,
             "metadata": {}
         }
@@ -46,15 +73,20 @@ class ChatService:
 
     @staticmethod
     async def list_conversations(limit: int = 50) -> List[Dict[str, Any]]:
-        """List all conversations"""
+        """List all conversations (summary fields only, without metadata)"""
         collection = MongoDB.get_collection("conversations")
 
-        cursor = collection.find().sort("updated_at", -1).limit(limit)
-        conversations = []
+        # One batch holding every result, read with a single to_list instead of per-document awaits
+        cursor = (
+            collection.find({}, CONVERSATION_SUMMARY_FIELDS)
+            .sort("updated_at", -1)
+            .limit(limit)
+            .batch_size(max(limit, 0))
+        )
+        conversations = await cursor.to_list(length=limit if limit > 0 else None)
 
-        async for conv in cursor:
+        for conv in conversations:
             conv["id"] = str(conv["_id"])
-            conversations.append(conv)
 
         return conversations
 
@@ -65,51 +97,130 @@ class ChatService:
         msg_collection = MongoDB.get_collection("messages")
 
         try:
-            # Delete all messages
+            # Delete images kept in GridFS, then all messages
+            stored_images = []
+            cursor = msg_collection.find(
+                {"conversation_id": conversation_id, "content.image_url": {"$regex": f"^{STORED_IMAGE_PREFIX}"}},
+                {"content.image_url": 1}
+            )
+            async for msg in cursor:
+                stored_images.extend(
+                    item["image_url"] for item in msg.get("content", [])
+                    if ImageService.is_stored_image(item.get("image_url"))
+                )
+            if stored_images:
+                await ImageService.delete_images(stored_images)
+
             await msg_collection.delete_many({"conversation_id": conversation_id})
 
-            # Delete conversation
-            result = await conv_collection.delete_one({"_id": ObjectId(conversation_id)})
-            return result.deleted_count > 0
+            # Delete conversation, then the uploaded CSV it referenced
+            conversation = await conv_collection.find_one_and_delete(
+                {"_id": ObjectId(conversation_id)},
+                projection={"metadata.active_csv_gridfs_id": 1}
+            )
+            if conversation is None:
+                return False
+            await CSVService.delete_stored_csv(conversation.get("metadata", {}).get("active_csv_gridfs_id"))
+            return True
         except Exception:
             return False
+        finally:
+            ChatService._invalidate_session(conversation_id)
 
     @staticmethod
-    async def add_message(
+    def build_message(
         conversation_id: str,
         role: MessageRole,
-        content: List[MessageContent],
+        content: List[Union[MessageContent, Dict[str, Any]]],
         metadata: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
-        """Add a message to a conversation"""
-        msg_collection = MongoDB.get_collection("messages")
-        conv_collection = MongoDB.get_collection("conversations")
-
+        """
+        Build a message document without persisting it
+        The ObjectId is assigned up front so the id is known before the write.
+        Content items may be MessageContent models or plain dicts built from
+        trusted server-side data; dicts are stored as-is without validation.
+        The token estimate and the display text (see display_text) are stored
+        with the message, so later reads don't have to re-scan the content.
+        """
+        message_id = ObjectId()
+        content_items = [c if isinstance(c, dict) else c.dict() for c in content]
         message = {
+            "_id": message_id,
+            "id": str(message_id),
             "conversation_id": conversation_id,
             "role": role.value,
-            "content": [c.dict() for c in content],
-            "timestamp": datetime.utcnow(),
+            "content": content_items,
+            "text": (content_items[0].get("text") or "") if content_items else "",
+            "timestamp": utc_now(),
             "metadata": metadata or {}
         }
+        message["token_count"] = ContextWindowService.estimate_message_tokens(message)
+        return message
+
+    @staticmethod
+    def display_text(message: Dict[str, Any]) -> str:
+        """Text shown for a message in session views: its first content item's text, or ""."""
+        text = message.get("text")
+        if text is not None:
+            return text
+        # Messages stored before "text" was recorded
+        content = message.get("content")
+        return (content[0].get("text") or "") if content else ""
+
+    @staticmethod
+    async def add_message(
+        conversation_id: str,
+        role: MessageRole,
+        content: List[Union[MessageContent, Dict[str, Any]]],
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Add a message to a conversation"""
+        message = ChatService.build_message(conversation_id, role, content, metadata)
+        await ChatService.add_messages_bulk(conversation_id, [message])
+        return message
+
+    @staticmethod
+    async def add_messages_bulk(conversation_id: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Persist several messages built with build_message in one insert_many
+        and bump the conversation's message_count with a single update.
+        Only the insert is awaited: the update runs in the background once the
+        insert succeeded, so a turn costs one round trip and a failed insert
+        never inflates message_count.
+        """
+        msg_collection = MongoDB.get_collection("messages")
+
+        try:
+            # "id" is only for API responses, don't store it
+            await msg_collection.insert_many(
+                [{k: v for k, v in message.items() if k != "id"} for message in messages],
+                ordered=False
+            )
+        finally:
+            ChatService._invalidate_session(conversation_id)
 
-        result = await msg_collection.insert_one(message)
-        message["id"] = str(result.inserted_id)
-        message["_id"] = result.inserted_id
+        task = asyncio.ensure_future(ChatService._touch_conversation(conversation_id, len(messages)))
+        _background_writes.add(task)
+        task.add_done_callback(_background_writes.discard)
+        return messages
 
-        # Update conversation
+    @staticmethod
+    async def _touch_conversation(conversation_id: str, added: int):
+        """Bump a conversation's updated_at and message_count after messages were added"""
+        conv_collection = MongoDB.get_collection("conversations")
         try:
             await conv_collection.update_one(
                 {"_id": ObjectId(conversation_id)},
                 {
-                    "$set": {"updated_at": datetime.utcnow()},
-                    "$inc": {"message_count": 1}
+                    "$set": {"updated_at": utc_now()},
+                    "$inc": {"message_count": added}
                 }
             )
-        except Exception:
-            pass
-
-        return message
+        except Exception as e:
+            logger.warning(f"Failed to update conversation {conversation_id} after adding messages: {str(e)}")
+        finally:
+            # Reads that ran between the insert and this update cached the old count
+            ChatService._invalidate_session(conversation_id)
 
     @staticmethod
     async def get_messages(
@@ -128,41 +239,330 @@ class ChatService:
         Returns:
             List of messages (potentially filtered by sliding window)
         """
-        collection = MongoDB.get_collection("messages")
-
-        cursor = collection.find({"conversation_id": conversation_id}).sort("timestamp", 1).limit(limit)
-        messages = []
-
-        async for msg in cursor:
-            msg["id"] = str(msg["_id"])
-            messages.append(msg)
-
-        # Apply sliding window if requested
+        # Only fetch the messages the window can keep instead of the whole history
         if apply_sliding_window:
-            result = ContextWindowService.apply_sliding_window(messages)
+            conversation = await ChatService.get_conversation_with_window(conversation_id)
+            if not conversation:
+                return []
+            messages = conversation["messages"]
+            result = ContextWindowService.apply_sliding_window(
+                messages,
+                total_messages=conversation.get("message_count", len(messages))
+            )
             logger.info(
-                f"Sliding window: {result['kept_messages']}/{result['total_messages']} messages, "
+                f"Sliding window: {result['kept_messages']}/{len(messages)} windowed messages, "
                 f"~{result['estimated_tokens']} tokens"
             )
             return result["messages"]
 
+        collection = MongoDB.get_collection("messages")
+
+        # One batch holding every result (the server default stops at 101 documents and
+        # needs getMore round trips after that), read with a single to_list
+        cursor = (
+            collection.find({"conversation_id": conversation_id})
+            .sort("timestamp", 1)
+            .limit(limit)
+            .batch_size(max(limit, 0))
+        )
+        messages = await cursor.to_list(length=limit if limit > 0 else None)
+
+        for msg in messages:
+            msg["id"] = str(msg["_id"])
+
         return messages
 
     @staticmethod
-    async def get_optimized_context(
+    async def get_conversation_with_window(
         conversation_id: str,
         max_messages: Optional[int] = None,
         preserve_first: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get a conversation and its sliding-window messages in a single round trip
+
+        Reads the first `preserve_first` messages and the most recent
+        `max_messages - preserve_first` ones with $lookup sub-pipelines on the
+        (conversation_id, timestamp) index, so the transfer is O(window)
+        rather than O(history). The messages are returned in chronological
+        order under "messages"; None if the conversation doesn't exist.
+        """
+        collection = MongoDB.get_collection("conversations")
+
+        try:
+            object_id = ObjectId(conversation_id)
+        except Exception:
+            return None
+
+        if settings.sliding_window_enabled:
+            head_size, tail_size = ChatService._window_sizes(max_messages, preserve_first)
+        else:
+            # Same as get_messages' default without a window
+            head_size, tail_size = 100, 0
+
+        # $limit must be positive, so empty ranges get no stage at all
+        pipeline = [{"$match": {"_id": object_id}}]
+        if head_size > 0:
+            pipeline.append(ChatService._messages_lookup(1, "window_head", head_size))
+        if tail_size > 0:
+            pipeline.append(ChatService._messages_lookup(-1, "window_tail", tail_size))
+
+        results = await collection.aggregate(pipeline).to_list(length=1)
+        if not results:
+            return None
+
+        conversation = results[0]
+        conversation["id"] = str(conversation["_id"])
+        conversation["messages"] = ChatService._merge_window(
+            conversation.pop("window_head", []),
+            conversation.pop("window_tail", [])
+        )
+        return conversation
+
+    @staticmethod
+    async def get_conversation_with_messages(
+        conversation_id: str,
+        limit: int = 100,
+        iso_timestamps: bool = False,
+        display: bool = False,
+        fields: Optional[Tuple[str, ...]] = None,
+        before: Optional[datetime] = None,
+        before_id: Optional[ObjectId] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get a conversation and its first `limit` messages in a single round trip
+
+        Same messages as get_messages without a window, returned under
+        "messages"; None if the conversation doesn't exist, so callers don't
+        need a separate existence check. With iso_timestamps, MongoDB formats
+        message timestamps as ISO 8601 strings so callers don't have to.
+        With display, MongoDB also renders each message in the session API's
+        {role, content, timestamp, metadata} shape (content is the first text),
+        so image and CSV payloads never leave the database. With fields, only
+        those message fields (plus _id) are fetched. With before, the page is
+        instead the `limit` most recent messages older than that timestamp
+        (keyset pagination: a range scan on the (conversation_id, timestamp, _id)
+        index, however deep the page), still in chronological order. Pass the
+        oldest returned message's _id as before_id too, so messages sharing its
+        timestamp are neither skipped nor repeated across pages.
+        Results are cached until the conversation is written to or the TTL
+        passes, so the returned document is shared and must not be modified.
+        Pages read with before are not cached: every client cursor would add
+        another variant under the conversation.
+        """
+        variant = (limit, iso_timestamps or display, display, fields)
+        cached = _session_cache.get(conversation_id, {}).get(variant) if before is None else None
+        if cached is not None and time.monotonic() - cached[1] <= SESSION_CACHE_TTL_SECONDS:
+            _session_cache.move_to_end(conversation_id)
+            return cached[0]
+
+        collection = MongoDB.get_collection("conversations")
+
+        try:
+            object_id = ObjectId(conversation_id)
+        except Exception:
+            return None
+
+        # Like find().limit(), a non-positive limit means no limit
+        pipeline = [
+            {"$match": {"_id": object_id}},
+            ChatService._messages_lookup(
+                1 if before is None else -1,
+                "messages",
+                limit if limit > 0 else None,
+                iso_timestamps or display,
+                display,
+                fields,
+                before,
+                before_id
+            )
+        ]
+
+        reads = _session_reads.setdefault(conversation_id, [0, 0])
+        reads[0] += 1
+        generation = reads[1]
+        try:
+            results = await collection.aggregate(pipeline).to_list(length=1)
+        finally:
+            reads[0] -= 1
+            overlapped_write = reads[1] != generation
+            if not reads[0]:
+                del _session_reads[conversation_id]
+        if not results:
+            return None
+
+        conversation = results[0]
+        conversation["id"] = str(conversation["_id"])
+        if before is not None:
+            conversation["messages"].reverse()
+        if not display:
+            for msg in conversation["messages"]:
+                msg["id"] = str(msg["_id"])
+
+        if before is not None:
+            return conversation
+
+        if overlapped_write:
+            # Written to while we were reading: the result may predate the write
+            _session_cache.pop(conversation_id, None)
+            return conversation
+
+        _session_cache.setdefault(conversation_id, {})[variant] = (conversation, time.monotonic())
+        _session_cache.move_to_end(conversation_id)
+        if len(_session_cache) > MAX_SESSION_CACHE_SIZE:
+            _session_cache.popitem(last=False)
+        return conversation
+
+    @staticmethod
+    async def get_conversations_with_messages(
+        conversation_ids: List[str],
+        limit: int = 100,
+        display: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Get several conversations and their first `limit` messages in a single round trip
+
+        Batch form of get_conversation_with_messages (uncached), so a page of
+        sessions costs one query instead of one per session. Malformed or
+        missing ids are left out; results follow the order of conversation_ids.
+        """
+        collection = MongoDB.get_collection("conversations")
+
+        object_ids = [ObjectId(conversation_id) for conversation_id in conversation_ids if ObjectId.is_valid(conversation_id)]
+        if not object_ids:
+            return []
+
+        pipeline = [
+            {"$match": {"_id": {"$in": object_ids}}},
+            ChatService._messages_lookup(1, "messages", limit if limit > 0 else None, display, display)
+        ]
+
+        conversations = {}
+        async for conversation in collection.aggregate(pipeline):
+            conversation["id"] = str(conversation["_id"])
+            if not display:
+                for msg in conversation["messages"]:
+                    msg["id"] = str(msg["_id"])
+            conversations[conversation["id"]] = conversation
+
+        return [conversations[conversation_id] for conversation_id in dict.fromkeys(conversation_ids)
+                if conversation_id in conversations]
+
+    @staticmethod
+    def _invalidate_session(conversation_id: str):
+        """Drop cached reads of a conversation after it changes"""
+        reads = _session_reads.get(conversation_id)
+        if reads is not None:
+            reads[1] += 1
+        _session_cache.pop(conversation_id, None)
+
+    @staticmethod
+    def _messages_lookup(
+        direction: int,
+        field: str,
+        limit: Optional[int] = None,
+        iso_timestamps: bool = False,
+        display: bool = False,
+        fields: Optional[Tuple[str, ...]] = None,
+        before: Optional[datetime] = None,
+        before_id: Optional[ObjectId] = None
     ) -> Dict[str, Any]:
+        """$lookup stage joining a conversation's messages in (timestamp, _id) order"""
+        pipeline = [
+            # messages.conversation_id holds the string form of the conversation _id
+            {"$match": {"$expr": {"$eq": ["$conversation_id", "$$cid"]}}},
+            # _id breaks timestamp ties, so pages cut between equal timestamps stay consistent
+            {"$sort": {"timestamp": direction, "_id": direction}}
+        ]
+        if before is not None and before_id is not None:
+            pipeline.insert(1, {"$match": {"$or": [
+                {"timestamp": {"$lt": before}},
+                {"timestamp": before, "_id": {"$lt": before_id}}
+            ]}})
+        elif before is not None:
+            pipeline.insert(1, {"$match": {"timestamp": {"$lt": before}}})
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+        if fields:
+            pipeline.append({"$project": {field: 1 for field in fields}})
+        if iso_timestamps:
+            # ISO 8601 with millisecond precision, always with 3 fractional digits ("...T09:30:00.120").
+            # This differs from the datetime.isoformat() these endpoints used to return (6 digits,
+            # no fraction at all on whole seconds); BSON dates only hold milliseconds anyway.
+            pipeline.append({"$addFields": {"timestamp": {
+                "$dateToString": {"date": "$timestamp", "format": "%Y-%m-%dT%H:%M:%S.%L"}
+            }}})
+        if display:
+            # Same text as display_text: the stored "text", else the first content item's text, else ""
+            pipeline.append({"$project": {
+                "_id": 0,
+                "role": 1,
+                "content": {"$ifNull": ["$text", {"$let": {
+                    "vars": {"first": {"$arrayElemAt": ["$content", 0]}},
+                    "in": {"$ifNull": ["$$first.text", ""]}
+                }}]},
+                "timestamp": 1,
+                "metadata": {"$literal": {}}
+            }})
+        return {
+            "$lookup": {
+                "from": "messages",
+                "let": {"cid": {"$toString": "$_id"}},
+                "pipeline": pipeline,
+                "as": field
+            }
+        }
+
+    @staticmethod
+    def _window_sizes(max_messages: Optional[int], preserve_first: Optional[int]) -> Tuple[int, int]:
+        """Split a sliding window into (oldest preserved, most recent) message counts"""
+        max_messages = max_messages or settings.sliding_window_max_messages
+        preserve_first = preserve_first or settings.sliding_window_preserve_first
+        head_size = min(preserve_first, max_messages)
+        return head_size, max_messages - head_size
+
+    @staticmethod
+    def _merge_window(head: List[Dict[str, Any]], tail: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Merge ascending head and descending tail messages into chronological order"""
+        # Short conversations make both ranges overlap
+        seen = {msg["_id"] for msg in head}
+        messages = head + [msg for msg in reversed(tail) if msg["_id"] not in seen]
+
+        for msg in messages:
+            msg["id"] = str(msg["_id"])
+
+        return messages
+
+    @staticmethod
+    async def get_optimized_context(
+        conversation_id: str,
+        max_messages: Optional[int] = None,
+        preserve_first: Optional[int] = None,
+        iso_timestamps: bool = False,
+        before: Optional[datetime] = None,
+        before_id: Optional[ObjectId] = None
+    ) -> Optional[Dict[str, Any]]:
         """
         Get optimized conversation context with sliding window applied
 
-        Returns messages + metadata about optimization
+        Returns messages + metadata about optimization; None if the
+        conversation doesn't exist. Messages only carry WINDOW_FIELDS.
+        With before (and before_id), the window is applied to the 200
+        messages preceding that (timestamp, _id) cursor.
         """
-        messages = await ChatService.get_messages(conversation_id, limit=200)
+        conversation = await ChatService.get_conversation_with_messages(
+            conversation_id,
+            limit=200,
+            iso_timestamps=iso_timestamps,
+            fields=WINDOW_FIELDS,
+            before=before,
+            before_id=before_id
+        )
+        if not conversation:
+            return None
 
         result = ContextWindowService.apply_sliding_window(
-            messages,
+            conversation["messages"],
             max_messages=max_messages,
             preserve_first=preserve_first
         )
@@ -170,10 +570,62 @@ class ChatService:
         return result
 
     @staticmethod
-    async def get_context_summary(conversation_id: str) -> Dict[str, Any]:
-        """Get summary of context window status for a conversation"""
-        messages = await ChatService.get_messages(conversation_id)
-        return ContextWindowService.get_context_summary(messages)
+    async def count_roles(conversation_id: str) -> Dict[str, Dict[str, int]]:
+        """
+        Count a conversation's messages and tokens per role in MongoDB
+        Tokens are summed from the token_count stored with each message, so
+        no content is fetched; only messages stored before token_count was
+        recorded are read and estimated here.
+        Returns {role: {"count": messages, "tokens": estimated tokens}}.
+        """
+        collection = MongoDB.get_collection("messages")
+        pipeline = [
+            {"$match": {"conversation_id": conversation_id}},
+            {"$group": {
+                "_id": "$role",
+                "count": {"$sum": 1},
+                "tokens": {"$sum": "$token_count"},
+                "untracked": {"$sum": {"$cond": [{"$eq": [{"$type": "$token_count"}, "missing"]}, 1, 0]}}
+            }}
+        ]
+        groups = {group["_id"]: group async for group in collection.aggregate(pipeline)}
+
+        if any(group["untracked"] for group in groups.values()):
+            cursor = collection.find(
+                {"conversation_id": conversation_id, "token_count": {"$exists": False}},
+                {"role": 1, "content.type": 1, "content.text": 1, "content.csv_data": 1}
+            )
+            async for msg in cursor:
+                groups[msg["role"]]["tokens"] += ContextWindowService.estimate_message_tokens(msg)
+
+        return {role: {"count": group["count"], "tokens": group["tokens"]} for role, group in groups.items()}
+
+    @staticmethod
+    async def get_context_summary(conversation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get summary of context window status for a conversation; None if it doesn't exist
+        Totals come from count_roles, whose per-role message counts are
+        included under "role_counts".
+        """
+        collection = MongoDB.get_collection("conversations")
+        try:
+            object_id = ObjectId(conversation_id)
+        except Exception:
+            return None
+
+        conversation, roles = await asyncio.gather(
+            collection.find_one({"_id": object_id}, {"_id": 1}),
+            ChatService.count_roles(conversation_id)
+        )
+        if not conversation:
+            return None
+
+        summary = ContextWindowService.summarize_totals(
+            sum(group["count"] for group in roles.values()),
+            sum(group["tokens"] for group in roles.values())
+        )
+        summary["role_counts"] = {role: group["count"] for role, group in roles.items()}
+        return summary
 
     @staticmethod
     async def update_conversation_title(conversation_id: str, title: str) -> bool:
@@ -183,11 +635,13 @@ class ChatService:
         try:
             result = await collection.update_one(
                 {"_id": ObjectId(conversation_id)},
-                {"$set": {"title": title, "updated_at": datetime.utcnow()}}
+                {"$set": {"title": title, "updated_at": utc_now()}}
             )
             return result.modified_count > 0
         except Exception:
             return False
+        finally:
+            ChatService._invalidate_session(conversation_id)
 
     @staticmethod
     async def update_conversation_metadata(conversation_id: str, metadata: Dict[str, Any]) -> bool:
@@ -205,84 +659,119 @@ class ChatService:
 
             result = await collection.update_one(
                 {"_id": ObjectId(conversation_id)},
-                {"$set": {"metadata": existing_metadata, "updated_at": datetime.utcnow()}}
+                {"$set": {"metadata": existing_metadata, "updated_at": utc_now()}}
             )
             return result.modified_count > 0
         except Exception as e:
             logger.error(f"Error updating conversation metadata: {str(e)}")
             return False
+        finally:
+            ChatService._invalidate_session(conversation_id)
 
     @staticmethod
     async def export_conversation(conversation_id: str, format: str = "json") -> Dict[str, Any]:
         """
         Export conversation in different formats
         Supports: json, markdown, text
+        Markdown and text are built from iter_export; stream that instead for large conversations.
         """
-        conversation = await ChatService.get_conversation(conversation_id)
-        if not conversation:
-            raise ValueError("Conversation not found")
-
-        messages = await ChatService.get_messages(conversation_id)
+        if format not in ("json", "markdown", "text"):
+            raise ValueError(f"Unsupported format: {format}")
 
         if format == "json":
+            conversation = await ChatService.get_conversation_with_messages(conversation_id)
+            if not conversation:
+                raise ValueError("Conversation not found")
+
+            # "id" already carries the ObjectId as a string; the raw _id isn't JSON serializable
             return {
-                "conversation": conversation,
-                "messages": messages
+                "conversation": {k: v for k, v in conversation.items() if k not in ("_id", "messages")},
+                "messages": [{k: v for k, v in msg.items() if k != "_id"} for msg in conversation["messages"]]
             }
-        elif format == "markdown":
-            md_lines = [
-                f"# {conversation.get('title', 'Conversation')}",
-                f"\n**Created:** {conversation.get('created_at').strftime('%Y-%m-%d %H:%M:%S')}",
-                f"\n**Messages:** {len(messages)}\n",
-                "---\n"
-            ]
 
-            for msg in messages:
-                role = msg.get('role', 'user').capitalize()
-                content_list = msg.get('content', [])
-                timestamp = msg.get('timestamp').strftime('%H:%M:%S')
+        conversation = await ChatService.get_conversation(conversation_id)
+        if not conversation:
+            raise ValueError("Conversation not found")
 
-                md_lines.append(f"### {role} ({timestamp})\n")
+        return {"content": "".join([part async for part in ChatService.iter_export(conversation, format)])}
 
-                for content_item in content_list:
-                    if content_item.get('type') == 'text' and content_item.get('text'):
-                        md_lines.append(f"{content_item['text']}\n")
-                    elif content_item.get('type') == 'image':
-                        md_lines.append(f"*[Image attached]*\n")
-                    elif content_item.get('type') == 'csv':
-                        md_lines.append(f"*[CSV data attached]*\n")
+    @staticmethod
+    async def iter_export(conversation: Dict[str, Any], format: str) -> AsyncIterator[str]:
+        """
+        Render a conversation as markdown or text, one message at a time
+        Messages are read from a cursor, so the whole export is never held in memory.
+        """
+        if format == "markdown":
+            render_header, render_message = ChatService._markdown_header, ChatService._markdown_message
+        elif format == "text":
+            render_header, render_message = ChatService._text_header, ChatService._text_message
+        else:
+            raise ValueError(f"Unsupported format: {format}")
 
-                md_lines.append("\n")
+        yield render_header(conversation)
 
-            return {"content": "\n".join(md_lines)}
+        collection = MongoDB.get_collection("messages")
+        cursor = collection.find({"conversation_id": conversation["id"]}).sort("timestamp", 1)
+        async for msg in cursor:
+            yield render_message(msg)
 
-        elif format == "text":
-            text_lines = [
-                f"Conversation: {conversation.get('title', 'Untitled')}",
-                f"Created: {conversation.get('created_at').strftime('%Y-%m-%d %H:%M:%S')}",
-                f"Messages: {len(messages)}",
-                "=" * 50,
-                ""
-            ]
+    @staticmethod
+    def _markdown_header(conversation: Dict[str, Any]) -> str:
+        """Markdown title block of an export"""
+        md_lines = [
+            f"# {conversation.get('title', 'Conversation')}",
+            f"\n**Created:** {conversation.get('created_at').strftime('%Y-%m-%d %H:%M:%S')}",
+            f"\n**Messages:** {conversation.get('message_count', 0)}\n",
+            "---\n"
+        ]
+        return "\n".join(md_lines) + "\n"
 
-            for msg in messages:
-                role = msg.get('role', 'user').upper()
-                content_list = msg.get('content', [])
-                timestamp = msg.get('timestamp').strftime('%H:%M:%S')
+    @staticmethod
+    def _markdown_message(msg: Dict[str, Any]) -> str:
+        """One message of a markdown export"""
+        role = msg.get('role', 'user').capitalize()
+        timestamp = msg.get('timestamp').strftime('%H:%M:%S')
 
-                text_lines.append(f"[{timestamp}] {role}:")
+        md_lines = [f"### {role} ({timestamp})\n"]
 
-                for content_item in content_list:
-                    if content_item.get('type') == 'text' and content_item.get('text'):
-                        text_lines.append(f"  {content_item['text']}")
-                    elif content_item.get('type') == 'image':
-                        text_lines.append(f"  [Image attached]")
-                    elif content_item.get('type') == 'csv':
-                        text_lines.append(f"  [CSV data attached]")
+        for content_item in msg.get('content', []):
+            if content_item.get('type') == 'text' and content_item.get('text'):
+                md_lines.append(f"{content_item['text']}\n")
+            elif content_item.get('type') == 'image':
+                md_lines.append(f"*[Image attached]*\n")
+            elif content_item.get('type') == 'csv':
+                md_lines.append(f"*[CSV data attached]*\n")
 
-                text_lines.append("")
+        md_lines.append("\n")
+        return "\n".join(md_lines) + "\n"
 
-            return {"content": "\n".join(text_lines)}
+    @staticmethod
+    def _text_header(conversation: Dict[str, Any]) -> str:
+        """Plain-text title block of an export"""
+        text_lines = [
+            f"Conversation: {conversation.get('title', 'Untitled')}",
+            f"Created: {conversation.get('created_at').strftime('%Y-%m-%d %H:%M:%S')}",
+            f"Messages: {conversation.get('message_count', 0)}",
+            "=" * 50,
+            ""
+        ]
+        return "\n".join(text_lines) + "\n"
 
-        else:
-            raise ValueError(f"Unsupported format: {format}")
+    @staticmethod
+    def _text_message(msg: Dict[str, Any]) -> str:
+        """One message of a plain-text export"""
+        role = msg.get('role', 'user').upper()
+        timestamp = msg.get('timestamp').strftime('%H:%M:%S')
+
+        text_lines = [f"[{timestamp}] {role}:"]
+
+        for content_item in msg.get('content', []):
+            if content_item.get('type') == 'text' and content_item.get('text'):
+                text_lines.append(f"  {content_item['text']}")
+            elif content_item.get('type') == 'image':
+                text_lines.append(f"  [Image attached]")
+            elif content_item.get('type') == 'csv':
+                text_lines.append(f"  [CSV data attached]")
+
+        text_lines.append("")
+        return "\n".join(text_lines) + "\n"
@@ -18,15 +18,21 @@ class ContextWindowService:
         """
         Estimate token count for text
         Rough estimation: ~1.3 tokens per word for English text
+        Words are counted from their separators with str.count, which scans in C
+        without building the list text.split() would; runs of whitespace count
+        extra, which is within the error of the estimate.
         """
         if not text:
             return 0
-        words = len(text.split())
+        words = text.count(" ") + text.count("\n") + 1
         return int(words * 1.3)
 
     @staticmethod
     def estimate_message_tokens(message: Dict[str, Any]) -> int:
-        """Estimate tokens for a single message"""
+        """Estimate tokens for a single message (the stored estimate when it has one)"""
+        if "token_count" in message:
+            return message["token_count"]
+
         total_tokens = 0
         content_list = message.get("content", [])
 
@@ -51,14 +57,16 @@ class ContextWindowService:
         messages: List[Dict[str, Any]],
         max_messages: Optional[int] = None,
         preserve_first: Optional[int] = None,
-        token_limit: Optional[int] = None
+        token_limit: Optional[int] = None,
+        total_messages: Optional[int] = None
     ) -> Dict[str, Any]:
         """
         Apply sliding window to messages
 
         Strategy:
         1. Always preserve first N messages (context establishment)
-        2. Keep most recent messages within limits
+        2. Keep most recent messages within limits, starting the window at a
+           multiple of half its size so it only grows between jumps
         3. Ensure token count stays under limit
 
         Args:
@@ -66,6 +74,8 @@ class ContextWindowService:
             max_messages: Maximum number of messages to keep
             preserve_first: Number of initial messages to always keep
             token_limit: Maximum token count
+            total_messages: Messages in the whole conversation, when `messages`
+                is only its first and most recent ones (defaults to len(messages))
 
         Returns:
             Dict with filtered messages and metadata
@@ -85,7 +95,7 @@ class ContextWindowService:
         preserve_first = preserve_first or settings.sliding_window_preserve_first
         token_limit = token_limit or settings.sliding_window_token_limit
 
-        total_messages = len(messages)
+        total_messages = max(total_messages or 0, len(messages))
 
         # If sliding window is disabled or messages within limit, return all
         if not settings.sliding_window_enabled or total_messages <= max_messages:
@@ -119,7 +129,11 @@ class ContextWindowService:
             kept_messages = preserved_messages
         else:
             # Keep most recent messages
-            recent_messages = remaining_messages[-available_slots:]
+            keep = ContextWindowService._stepped_window_size(
+                total_messages - len(preserved_messages),
+                available_slots
+            )
+            recent_messages = remaining_messages[-keep:]
             kept_messages = preserved_messages + recent_messages
 
         # Check token limit and further reduce if needed
@@ -153,10 +167,38 @@ class ContextWindowService:
             "preserved_count": min(preserve_first, len(kept_messages))
         }
 
+    @staticmethod
+    def _stepped_window_size(sliding_count: int, slots: int) -> int:
+        """
+        Number of recent messages to keep out of `sliding_count`
+
+        A window that drops one old message per turn changes the prompt prefix
+        every time, so providers can never reuse their prompt cache. Instead the
+        window start only moves in steps of half the window: between steps new
+        messages are appended behind an unchanged prefix.
+        """
+        if sliding_count <= slots:
+            return sliding_count
+        step = max(slots // 2, 1)
+        start = -(-(sliding_count - slots) // step) * step  # Round up to a whole step
+        return sliding_count - start
+
     @staticmethod
     def get_context_summary(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Get a summary of the current context window status"""
         if not messages:
+            return ContextWindowService.summarize_totals(0, 0)
+
+        total_tokens = sum(
+            ContextWindowService.estimate_message_tokens(msg)
+            for msg in messages
+        )
+        return ContextWindowService.summarize_totals(len(messages), total_tokens)
+
+    @staticmethod
+    def summarize_totals(total_messages: int, total_tokens: int) -> Dict[str, Any]:
+        """Context window status from message and token totals (e.g. aggregated by MongoDB)"""
+        if not total_messages:
             return {
                 "total_messages": 0,
                 "estimated_tokens": 0,
@@ -164,28 +206,23 @@ class ContextWindowService:
                 "needs_optimization": False
             }
 
-        total_tokens = sum(
-            ContextWindowService.estimate_message_tokens(msg)
-            for msg in messages
-        )
-
         max_messages = settings.sliding_window_max_messages
         token_limit = settings.sliding_window_token_limit
 
         needs_optimization = (
-            len(messages) > max_messages or
+            total_messages > max_messages or
             total_tokens > token_limit
         )
 
         return {
-            "total_messages": len(messages),
+            "total_messages": total_messages,
             "estimated_tokens": total_tokens,
             "max_messages": max_messages,
             "token_limit": token_limit,
             "within_limits": not needs_optimization,
             "needs_optimization": needs_optimization,
             "token_usage_percent": (total_tokens / token_limit * 100) if token_limit > 0 else 0,
-            "message_usage_percent": (len(messages) / max_messages * 100) if max_messages > 0 else 0
+            "message_usage_percent": (total_messages / max_messages * 100) if max_messages > 0 else 0
         }
 
     @staticmethod
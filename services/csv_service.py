@@ -3,12 +3,25 @@ import io
 import aiohttp
 import os
 import asyncio
+import datetime
+import hashlib
+import json
 import logging
-from typing import Dict, Any, Optional, List
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Callable, Dict, Any, Optional, List, Tuple
 from urllib.parse import urlparse
 from contextlib import asynccontextmanager
+import pybase64
+from bson import ObjectId
+from config import settings
+from database import MongoDB
 from services.visualization_service import VisualizationService
 
+logger = logging.getLogger(__name__)
+
 # Try to import PandasAI, but make it optional
 try:
     from pandasai import SmartDataframe
@@ -17,18 +30,43 @@ try:
 except ImportError:
     PANDASAI_AVAILABLE = False
 
+# pyarrow's multi-threaded CSV reader is optional; pandas' C engine is used without it
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Downloaded frames are kept on disk as Feather (fast, no code execution on load) when pyarrow is installed
+DISK_FRAME_FORMAT = "feather" if PYARROW_AVAILABLE else "pkl"
+
+# Uploaded CSVs are kept in GridFS and referenced from conversation metadata by file id
+CSV_BUCKET = "csv_files"
+
+# Parsed DataFrames keyed by a digest of the raw CSV bytes or a GridFS file id (LRU, shared process-wide).
+# Cached frames are shared between callers and must be treated as read-only.
+_dataframe_cache: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+MAX_DATAFRAME_CACHE_SIZE = 64
+
 
 class CSVService:
     """Service for handling CSV uploads and analysis"""
     
-    def __init__(self, openai_api_key: Optional[str] = None, max_tokens: int = 500, timeout: int = 30):
-        """Initialize CSVService with optional OpenAI API key for PandasAI"""
+    def __init__(self, openai_api_key: Optional[str] = None, max_tokens: int = 500, timeout: int = 30,
+                 cpu_pool: Optional[Executor] = None):
+        """Initialize CSVService with optional OpenAI API key for PandasAI and CPU worker pool"""
         self.openai_api_key = openai_api_key or os.getenv('OPENAI_API_KEY')
         self.pandasai_available = PANDASAI_AVAILABLE and self.openai_api_key
         self.max_tokens = max_tokens
         self.timeout = timeout
+        self._cpu_pool = cpu_pool  # Executor for pandas parsing/analysis; None uses the default thread pool
         self._session: Optional[aiohttp.ClientSession] = None
         self._smart_dfs: Dict[str, Any] = {}  # Cache for SmartDataframes by conversation_id
+        self._llm = None  # PandasAI LLM client, created once and shared by all SmartDataframes
+        # Downloaded CSVs by URL: (ETag, Last-Modified, DataFrame, fetched at) for conditional GETs
+        self._url_cache: "OrderedDict[str, Tuple[Optional[str], Optional[str], pd.DataFrame, float]]" = OrderedDict()
+        self._max_url_cache_size = 64
+        self._url_cache_ttl = 600  # Seconds a download is reused without revalidating
         self._max_dataframe_size = 10000  # Max rows for PandasAI processing
         
         # Configure logging
@@ -42,10 +80,7 @@ class CSVService:
 
     async def __aenter__(self):
         """Async context manager entry"""
-        self._session = aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=30),
-            connector=aiohttp.TCPConnector(limit=100, limit_per_host=30)
-        )
+        self._session = self._new_session()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -58,12 +93,25 @@ class CSVService:
     def session(self) -> aiohttp.ClientSession:
         """Get or create aiohttp session"""
         if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession(
-                timeout=aiohttp.ClientTimeout(total=30),
-                connector=aiohttp.TCPConnector(limit=100, limit_per_host=30)
-            )
+            self._session = self._new_session()
         return self._session
 
+    def _new_session(self) -> aiohttp.ClientSession:
+        """
+        Create the pooled aiohttp session
+        The service is shared app-wide, so idle connections and DNS answers are kept
+        long enough for follow-up downloads from the same host to reuse them.
+        """
+        return aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=30,
+                ttl_dns_cache=300,
+                keepalive_timeout=60
+            )
+        )
+
     async def close_session(self):
         """Close the aiohttp session"""
         if self._session and not self._session.closed:
@@ -71,32 +119,181 @@ class CSVService:
             self._session = None
 
     async def load_csv_from_url(self, url: str) -> pd.DataFrame:
-        """Load CSV from a URL using session reuse"""
+        """
+        Load CSV from a URL using session reuse
+        Recently downloaded URLs are served from memory; older ones are revalidated
+        with a conditional GET and the parsed DataFrame is reused on 304 Not Modified.
+        Downloads with validators are also kept on disk so revalidation survives restarts.
+        """
         try:
             # Validate URL
             parsed = urlparse(url)
             if not parsed.scheme in ['http', 'https']:
                 raise ValueError("Invalid URL scheme. Only HTTP and HTTPS are supported")
 
-            async with self.session.get(url) as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to fetch CSV: HTTP {response.status}")
-
-                content = await response.read()
-                df = pd.read_csv(io.BytesIO(content))
-                return df
+            headers = {}
+            cached = self._url_cache.get(url)
+            if cached:
+                etag, last_modified, df, fetched_at = cached
+                if time.monotonic() - fetched_at < self._url_cache_ttl:
+                    self._url_cache.move_to_end(url)
+                    return df
+            else:
+                # Not in memory (e.g. after a restart): revalidate the copy on disk instead
+                etag, last_modified = await asyncio.to_thread(_read_disk_validators, url)
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+            df = await self._get_csv(url, headers, cached)
+            if df is None:
+                # The copy on disk is missing or unreadable: fetch the whole file again
+                df = await self._get_csv(url, {}, None)
+            return df
 
         except Exception as e:
             raise Exception(f"Error loading CSV from URL: {str(e)}")
 
+    async def _get_csv(self, url: str, headers: Dict[str, str], cached: Optional[Tuple]) -> Optional[pd.DataFrame]:
+        """
+        GET a CSV, conditionally if headers carry validators
+        Returns None on 304 Not Modified when the on-disk copy can't be loaded.
+        """
+        async with self.session.get(url, headers=headers) as response:
+            if response.status == 304 and headers:
+                etag, last_modified = headers.get("If-None-Match"), headers.get("If-Modified-Since")
+                if cached:
+                    df = cached[2]
+                else:
+                    df = await asyncio.to_thread(_read_disk_frame, url)
+                    if df is None:
+                        return None
+                self._remember_url(url, etag, last_modified, df)
+                return df
+
+            if response.status != 200:
+                raise Exception(f"Failed to fetch CSV: HTTP {response.status}")
+
+            content = await response.read()
+            df = await self.parse_csv_bytes(content)
+
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            self._remember_url(url, etag, last_modified, df)
+            if etag or last_modified:
+                await asyncio.to_thread(_write_disk_cache, url, etag, last_modified, df)
+
+            return df
+
+    def _remember_url(self, url: str, etag: Optional[str], last_modified: Optional[str], df: pd.DataFrame):
+        """Keep a downloaded DataFrame in the per-URL LRU, marked as fetched now"""
+        self._url_cache[url] = (etag, last_modified, df, time.monotonic())
+        self._url_cache.move_to_end(url)
+        if len(self._url_cache) > self._max_url_cache_size:
+            self._url_cache.popitem(last=False)
+
     @staticmethod
     def load_csv_from_bytes(data: bytes) -> pd.DataFrame:
-        """Load CSV from bytes"""
-        try:
-            df = pd.read_csv(io.BytesIO(data))
+        """Load CSV from bytes, reusing the parsed DataFrame for identical content"""
+        key = hashlib.blake2b(data, digest_size=16).hexdigest()
+        df = _dataframe_cache.get(key)
+        if df is not None:
+            _dataframe_cache.move_to_end(key)
             return df
-        except Exception as e:
-            raise Exception(f"Error parsing CSV: {str(e)}")
+
+        df = _parse_csv(data)
+        CSVService._cache_dataframe(key, df)
+        return df
+
+    async def parse_csv_bytes(self, data: bytes) -> pd.DataFrame:
+        """Like load_csv_from_bytes, but parses cache misses off the event loop"""
+        key = hashlib.blake2b(data, digest_size=16).hexdigest()
+        df = _dataframe_cache.get(key)
+        if df is not None:
+            _dataframe_cache.move_to_end(key)
+            return df
+
+        df = await self._run_cpu(_parse_csv, data)
+        CSVService._cache_dataframe(key, df)
+        return df
+
+    @staticmethod
+    def _cache_dataframe(key: str, df: pd.DataFrame):
+        """Store a parsed DataFrame in the process-wide LRU"""
+        _dataframe_cache[key] = df
+        if len(_dataframe_cache) > MAX_DATAFRAME_CACHE_SIZE:
+            _dataframe_cache.popitem(last=False)
+
+    async def _run_cpu(self, func, *args):
+        """
+        Run CPU-bound pandas work off the event loop
+        Uses the shared process pool when one was provided, else the default thread pool
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._cpu_pool, func, *args)
+
+    @staticmethod
+    async def store_csv(filename: str, data: bytes, df: Optional[pd.DataFrame] = None) -> str:
+        """
+        Store raw CSV bytes in GridFS and return the file id
+        Pass the frame already parsed from the upload so the first follow-up
+        turn doesn't download the file back from GridFS
+        """
+        bucket = MongoDB.get_gridfs_bucket(CSV_BUCKET)
+        file_id = str(await bucket.upload_from_stream(filename, io.BytesIO(data)))
+        if df is not None:
+            CSVService._cache_dataframe(_stored_csv_key(file_id), df)
+        return file_id
+
+    @staticmethod
+    async def load_stored_csv(metadata: Dict[str, Any]) -> Optional[bytes]:
+        """
+        Load the raw bytes of a conversation's uploaded CSV
+        Falls back to the base64 copy that older versions kept in the metadata itself
+        """
+        if metadata.get("active_csv_gridfs_id"):
+            bucket = MongoDB.get_gridfs_bucket(CSV_BUCKET)
+            grid_out = await bucket.open_download_stream(ObjectId(metadata["active_csv_gridfs_id"]))
+            return await grid_out.read()
+        if metadata.get("active_csv_data"):
+            return pybase64.b64decode(metadata["active_csv_data"])
+        return None
+
+    async def load_stored_dataframe(self, metadata: Dict[str, Any]) -> Optional[pd.DataFrame]:
+        """
+        Load a conversation's uploaded CSV as a DataFrame
+        GridFS files never change, so the frame is cached by file id and later
+        turns skip both the download and the parse
+        """
+        file_id = metadata.get("active_csv_gridfs_id")
+        key = _stored_csv_key(file_id) if file_id else None
+        if key:
+            df = _dataframe_cache.get(key)
+            if df is not None:
+                _dataframe_cache.move_to_end(key)
+                return df
+
+        data = await CSVService.load_stored_csv(metadata)
+        if data is None:
+            return None
+
+        df = await self.parse_csv_bytes(data)
+        if key:
+            CSVService._cache_dataframe(key, df)
+        return df
+
+    @staticmethod
+    async def delete_stored_csv(file_id: Optional[str]):
+        """Delete a stored CSV by file id (and its cached frame), ignoring ones already gone"""
+        if not file_id:
+            return
+        _dataframe_cache.pop(_stored_csv_key(file_id), None)
+        bucket = MongoDB.get_gridfs_bucket(CSV_BUCKET)
+        try:
+            await bucket.delete(ObjectId(file_id))
+        except Exception:
+            pass
 
     @staticmethod
     def get_basic_info(df: pd.DataFrame) -> Dict[str, Any]:
@@ -285,11 +482,12 @@ class CSVService:
             # Sample dataframe if too large
             processed_df = self._sample_dataframe_if_large(df)
             
-            llm = OpenAI(api_token=self.openai_api_key)
+            if self._llm is None:
+                self._llm = OpenAI(api_token=self.openai_api_key)
             smart_df = SmartDataframe(
                 processed_df,
                 config={
-                    "llm": llm,
+                    "llm": self._llm,
                     "max_output_tokens": self.max_tokens,
                     "timeout": self.timeout,
                     "enable_cache": True,
@@ -323,7 +521,8 @@ class CSVService:
         
         return any(pattern in query_lower for pattern in complex_patterns)
 
-    def _create_response(self, response_type: str, success: bool, result: Any = None, 
+    @staticmethod
+    def _create_response(response_type: str, success: bool, result: Any = None, 
                         message: str = None, metadata: Dict[str, Any] = None) -> Dict[str, Any]:
         """Create standardized response structure"""
         response = {
@@ -462,7 +661,7 @@ class CSVService:
 
         # If visualization is requested, generate it
         if wants_visualization:
-            viz_result = VisualizationService.auto_visualize(df, query)
+            viz_result = await self._run_cpu(VisualizationService.auto_visualize, df, query)
             if viz_result.get("success"):
                 return self._create_response(
                     "visualization", True,
@@ -481,88 +680,7 @@ class CSVService:
                 return pandasai_result
 
         # Fall back to rule-based approach
-
-        # Summarize dataset
-        if any(word in query_lower for word in ['summarize', 'summary', 'overview', 'describe']):
-            return self._create_response(
-                "summary", True,
-                result={
-                    "basic_info": CSVService.get_basic_info(df),
-                    "stats": CSVService.get_summary_stats(df),
-                    "missing": CSVService.get_missing_values(df)
-                },
-                metadata={"method": "rule_based", "query": query}
-            )
-
-        # Basic stats
-        if any(word in query_lower for word in ['stats', 'statistics', 'statistical']):
-            return self._create_response(
-                "statistics", True,
-                result=CSVService.get_summary_stats(df),
-                metadata={"method": "rule_based", "query": query}
-            )
-
-        # Missing values
-        if any(word in query_lower for word in ['missing', 'null', 'nan', 'empty']):
-            return self._create_response(
-                "missing_values", True,
-                result=CSVService.get_missing_values(df),
-                metadata={"method": "rule_based", "query": query}
-            )
-
-        # Histogram/distribution
-        if any(word in query_lower for word in ['histogram', 'distribution', 'plot']):
-            # Try to extract column name
-            for col in df.columns:
-                if col.lower() in query_lower:
-                    try:
-                        return self._create_response(
-                            "histogram", True,
-                            result=CSVService.get_histogram_data(df, col),
-                            metadata={"method": "rule_based", "query": query, "column": col}
-                        )
-                    except ValueError:
-                        pass
-
-            return self._create_response(
-                "error", False,
-                message="Please specify a numeric column for histogram",
-                metadata={"method": "rule_based", "query": query}
-            )
-
-        # Column info - check for unique values specifically
-        if any(word in query_lower for word in ['unique', 'distinct', 'different']):
-            for col in df.columns:
-                if col.lower() in query_lower:
-                    return self._create_response(
-                        "column_info", True,
-                        result=CSVService.get_column_info(df, col, return_all_unique=True),
-                        metadata={"method": "rule_based", "query": query, "column": col}
-                    )
-
-        # General column info
-        for col in df.columns:
-            if col.lower() in query_lower:
-                return self._create_response(
-                    "column_info", True,
-                    result=CSVService.get_column_info(df, col),
-                    metadata={"method": "rule_based", "query": query, "column": col}
-                )
-
-        # Preview data
-        if any(word in query_lower for word in ['show', 'preview', 'display', 'head', 'first']):
-            return self._create_response(
-                "preview", True,
-                result=CSVService.get_data_preview(df),
-                metadata={"method": "rule_based", "query": query}
-            )
-
-        # Default: basic info
-        return self._create_response(
-            "basic_info", True,
-            result=CSVService.get_basic_info(df),
-            metadata={"method": "rule_based", "query": query}
-        )
+        return await self._run_cpu(_analyze_rule_based, df, query)
 
     async def get_comprehensive_analysis(self, df: pd.DataFrame, conversation_id: Optional[str] = None) -> Dict[str, Any]:
         """Get comprehensive analysis including both traditional stats and AI insights"""
@@ -599,3 +717,250 @@ class CSVService:
             "max_dataframe_size": self._max_dataframe_size,
             "pandasai_available": self.pandasai_available
         }
+
+
+def _stored_csv_key(file_id: str) -> str:
+    """DataFrame cache key for a CSV stored in GridFS"""
+    return f"gridfs:{file_id}"
+
+
+def _disk_cache_paths(url: str) -> Tuple[str, str]:
+    """Validator and DataFrame file paths for a URL in the on-disk download cache"""
+    name = hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+    return (
+        os.path.join(settings.csv_cache_dir, f"{name}.json"),
+        os.path.join(settings.csv_cache_dir, f"{name}.{DISK_FRAME_FORMAT}")
+    )
+
+
+def _read_disk_validators(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """ETag and Last-Modified of a URL's cached download, if it is on disk"""
+    meta_path, frame_path = _disk_cache_paths(url)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if not os.path.exists(frame_path):
+        return None, None
+    return meta.get("etag"), meta.get("last_modified")
+
+
+def _read_disk_frame(url: str) -> Optional[pd.DataFrame]:
+    """Load a URL's cached DataFrame from disk, or None if it is missing or unreadable"""
+    frame_path = _disk_cache_paths(url)[1]
+    try:
+        if DISK_FRAME_FORMAT == "feather":
+            df = pd.read_feather(frame_path)
+        else:
+            df = pd.read_pickle(frame_path)
+        # Reads count as use for the LRU eviction in _evict_disk_cache
+        os.utime(frame_path)
+        return df
+    except Exception as e:
+        logger.warning(f"Failed to load cached CSV download {frame_path}: {str(e)}")
+        return None
+
+
+def _write_disk_cache(url: str, etag: Optional[str], last_modified: Optional[str], df: pd.DataFrame):
+    """
+    Store a downloaded DataFrame (so 304s skip the CSV parse) with its validators
+    Each file is written to a temporary name and renamed into place, so readers never
+    see a partial file. The old validators are removed first, so a crash part-way
+    leaves a frame without validators, which is simply fetched again.
+    """
+    meta_path, frame_path = _disk_cache_paths(url)
+    try:
+        os.makedirs(settings.csv_cache_dir, exist_ok=True)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        if DISK_FRAME_FORMAT == "feather":
+            _write_atomic(frame_path, df.to_feather)
+        else:
+            _write_atomic(frame_path, df.to_pickle)
+        _write_atomic(meta_path, lambda path: _dump_json(path, {"url": url, "etag": etag, "last_modified": last_modified}))
+        _evict_disk_cache()
+    except Exception as e:
+        logger.warning(f"Failed to cache CSV download on disk: {str(e)}")
+
+
+def _write_atomic(path: str, write: Callable[[str], Any]):
+    """Write a file through a temporary file in the same directory, then rename it into place"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _dump_json(path: str, data: Dict[str, Any]):
+    """Write data to path as JSON"""
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def _evict_disk_cache():
+    """Remove the least recently used downloads until the cache fits in csv_cache_max_mb"""
+    # Download name -> [last used, total bytes, files]; a download is its validators plus its frame
+    entries: Dict[str, List[Any]] = {}
+    with os.scandir(settings.csv_cache_dir) as it:
+        for entry in it:
+            name, ext = os.path.splitext(entry.name)
+            if ext == ".tmp" or not entry.is_file():
+                continue
+            stat = entry.stat()
+            item = entries.setdefault(name, [0.0, 0, []])
+            item[0] = max(item[0], stat.st_mtime)
+            item[1] += stat.st_size
+            item[2].append(entry.path)
+
+    total = sum(size for _, size, _ in entries.values())
+    limit = settings.csv_cache_max_mb * 1024 * 1024
+    for _, size, paths in sorted(entries.values(), key=lambda item: item[0]):
+        if total <= limit:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+
+
+def _parse_csv(data: bytes) -> pd.DataFrame:
+    """
+    Parse raw CSV bytes (module-level so it can run in a worker process)
+    Uses pyarrow's multi-threaded reader when installed; files it rejects
+    (ragged rows, odd quoting) are retried with pandas' C engine.
+    Both paths return the same values (see _with_c_engine_dates).
+    """
+    try:
+        if PYARROW_AVAILABLE:
+            try:
+                df = pd.read_csv(io.BytesIO(data), engine="pyarrow")
+            except Exception:
+                pass
+            else:
+                return _with_c_engine_dates(df, data)
+        return pd.read_csv(io.BytesIO(data), engine="c")
+    except Exception as e:
+        raise Exception(f"Error parsing CSV: {str(e)}")
+
+
+def _with_c_engine_dates(df: pd.DataFrame, data: bytes) -> pd.DataFrame:
+    """
+    Replace the date/time columns pyarrow infers with the C engine's reading of them
+    The C engine leaves dates as their source text (blanks as NaN), so a file parses
+    to the same values with either engine, and no Timestamp, datetime.date or NaT
+    values reach bson.encode and orjson, which cannot serialize them.
+    """
+    temporal = [column for column in df.columns if _is_temporal(df[column])]
+    if not temporal:
+        return df
+
+    if df.columns.is_unique:
+        text = pd.read_csv(io.BytesIO(data), engine="c", usecols=temporal)
+        if len(text) == len(df):
+            df[temporal] = text[temporal]
+            return df
+    return pd.read_csv(io.BytesIO(data), engine="c")
+
+
+def _is_temporal(series: pd.Series) -> bool:
+    """Whether pyarrow read a column as dates, times or timestamps"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    if series.dtype == object:
+        sample = series.dropna()
+        return not sample.empty and isinstance(sample.iloc[0], (datetime.date, datetime.time))
+    return False
+
+
+def _analyze_rule_based(df: pd.DataFrame, query: str) -> Dict[str, Any]:
+    """Rule-based query analysis (module-level so it can run in a worker process)"""
+    query_lower = query.lower()
+
+    # Summarize dataset
+    if any(word in query_lower for word in ['summarize', 'summary', 'overview', 'describe']):
+        return CSVService._create_response(
+            "summary", True,
+            result={
+                "basic_info": CSVService.get_basic_info(df),
+                "stats": CSVService.get_summary_stats(df),
+                "missing": CSVService.get_missing_values(df)
+            },
+            metadata={"method": "rule_based", "query": query}
+        )
+
+    # Basic stats
+    if any(word in query_lower for word in ['stats', 'statistics', 'statistical']):
+        return CSVService._create_response(
+            "statistics", True,
+            result=CSVService.get_summary_stats(df),
+            metadata={"method": "rule_based", "query": query}
+        )
+
+    # Missing values
+    if any(word in query_lower for word in ['missing', 'null', 'nan', 'empty']):
+        return CSVService._create_response(
+            "missing_values", True,
+            result=CSVService.get_missing_values(df),
+            metadata={"method": "rule_based", "query": query}
+        )
+
+    # Histogram/distribution
+    if any(word in query_lower for word in ['histogram', 'distribution', 'plot']):
+        # Try to extract column name
+        for col in df.columns:
+            if col.lower() in query_lower:
+                try:
+                    return CSVService._create_response(
+                        "histogram", True,
+                        result=CSVService.get_histogram_data(df, col),
+                        metadata={"method": "rule_based", "query": query, "column": col}
+                    )
+                except ValueError:
+                    pass
+
+        return CSVService._create_response(
+            "error", False,
+            message="Please specify a numeric column for histogram",
+            metadata={"method": "rule_based", "query": query}
+        )
+
+    # Column info - check for unique values specifically
+    if any(word in query_lower for word in ['unique', 'distinct', 'different']):
+        for col in df.columns:
+            if col.lower() in query_lower:
+                return CSVService._create_response(
+                    "column_info", True,
+                    result=CSVService.get_column_info(df, col, return_all_unique=True),
+                    metadata={"method": "rule_based", "query": query, "column": col}
+                )
+
+    # General column info
+    for col in df.columns:
+        if col.lower() in query_lower:
+            return CSVService._create_response(
+                "column_info", True,
+                result=CSVService.get_column_info(df, col),
+                metadata={"method": "rule_based", "query": query, "column": col}
+            )
+
+    # Preview data
+    if any(word in query_lower for word in ['show', 'preview', 'display', 'head', 'first']):
+        return CSVService._create_response(
+            "preview", True,
+            result=CSVService.get_data_preview(df),
+            metadata={"method": "rule_based", "query": query}
+        )
+
+    # Default: basic info
+    return CSVService._create_response(
+        "basic_info", True,
+        result=CSVService.get_basic_info(df),
+        metadata={"method": "rule_based", "query": query}
+    )
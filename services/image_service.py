@@ -1,8 +1,26 @@
-import base64
+import asyncio
+import pybase64
 import io
-from typing import Optional, Tuple
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
 from PIL import Image
 from config import settings
+from database import MongoDB
+
+# Images are kept in GridFS and referenced from messages by URI
+IMAGE_BUCKET = "images"
+STORED_IMAGE_PREFIX = "gridfs://"
+IMAGE_ROUTE = "/api/images/"  # Serves stored images to clients, see routers/images.py
+
+# Data URLs of stored images already sent to the model: gridfs:// URI -> data URL.
+# Stored images never change, so a URI always maps to the same data URL; bounded by size.
+_data_url_cache: "OrderedDict[str, str]" = OrderedDict()
+_data_url_cache_bytes = 0
+MAX_DATA_URL_CACHE_BYTES = 64 * 1024 * 1024
+
+# Leading bytes of JPEG, PNG and GIF files (WebP is checked separately)
+IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a")
 
 
 class ImageService:
@@ -24,23 +42,40 @@ class ImageService:
                 image_type = None
 
             # Decode base64
-            image_bytes = base64.b64decode(encoded)
+            image_bytes = pybase64.b64decode(encoded)
+
+        except Exception as e:
+            return False, f"Invalid image data: {str(e)}"
+
+        return ImageService.validate_image_bytes(image_bytes, image_type)
+
+    @staticmethod
+    def validate_image_bytes(image_bytes: bytes, image_type: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+        """
+        Validate raw image bytes, e.g. straight from an upload
+        Returns (is_valid, error_message)
+        """
+        try:
+            # Check image type if provided
+            if image_type:
+                if image_type not in settings.allowed_image_types:
+                    return False, f"Image type {image_type} not allowed"
 
             # Check file size
             max_size = settings.max_file_size_mb * 1024 * 1024
             if len(image_bytes) > max_size:
                 return False, f"Image size exceeds {settings.max_file_size_mb}MB limit"
 
+            # Cheap signature check before handing the bytes to PIL
+            if not image_bytes.startswith(IMAGE_SIGNATURES) and not (
+                image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP"
+            ):
+                return False, "Invalid image data: unrecognized image format"
+
             # Validate with PIL
             image = Image.open(io.BytesIO(image_bytes))
             image.verify()
 
-            # Check image type if provided
-            if image_type:
-                allowed_types = settings.allowed_image_types.split(',')
-                if image_type not in allowed_types:
-                    return False, f"Image type {image_type} not allowed"
-
             return True, None
 
         except Exception as e:
@@ -55,7 +90,7 @@ class ImageService:
             else:
                 encoded = image_data
 
-            image_bytes = base64.b64decode(encoded)
+            image_bytes = pybase64.b64decode(encoded)
             image = Image.open(io.BytesIO(image_bytes))
 
             return {
@@ -80,3 +115,150 @@ class ImageService:
         # If it's raw base64, add the data URL prefix
         # Assume JPEG if format not specified
         return f"data:image/jpeg;base64,{image_data}"
+
+    @staticmethod
+    def is_stored_image(image_url: Optional[str]) -> bool:
+        """Whether an image_url points to GridFS rather than holding inline data"""
+        return bool(image_url) and image_url.startswith(STORED_IMAGE_PREFIX)
+
+    @staticmethod
+    def public_image_url(image_url: Optional[str]) -> Optional[str]:
+        """URL clients can fetch a stored image from; other image URLs are returned unchanged"""
+        if ImageService.is_stored_image(image_url):
+            return f"{IMAGE_ROUTE}{image_url[len(STORED_IMAGE_PREFIX):]}"
+        return image_url
+
+    @staticmethod
+    def with_public_image_urls(message: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of a stored message with gridfs:// image URIs swapped for fetchable URLs"""
+        content = message.get("content", [])
+        if not any(ImageService.is_stored_image(item.get("image_url")) for item in content):
+            return message
+        return {**message, "content": [
+            {**item, "image_url": ImageService.public_image_url(item["image_url"])}
+            if ImageService.is_stored_image(item.get("image_url")) else item
+            for item in content
+        ]}
+
+    @staticmethod
+    async def store_image(image_data: str) -> str:
+        """
+        Decode base64 / data URL image data once and store the bytes in GridFS
+        Returns a gridfs:// URI to keep in the message instead of the payload
+        """
+        if image_data.startswith('data:image'):
+            header, encoded = image_data.split(',', 1)
+            content_type = header.split(';')[0].split(':')[1]
+        else:
+            encoded = image_data
+            content_type = "image/jpeg"
+
+        return await ImageService.store_image_bytes(pybase64.b64decode(encoded), content_type)
+
+    @staticmethod
+    async def store_image_bytes(
+        image_bytes: bytes,
+        content_type: str,
+        file_id: Optional[ObjectId] = None
+    ) -> str:
+        """
+        Store raw image bytes (e.g. an upload) in GridFS and return its gridfs:// URI
+        Pass a pre-assigned file_id to know the URI before the write finishes.
+        """
+        bucket = MongoDB.get_gridfs_bucket(IMAGE_BUCKET)
+        file_id = file_id or ObjectId()
+        await bucket.upload_from_stream_with_id(
+            file_id,
+            "image",
+            io.BytesIO(image_bytes),
+            metadata={"contentType": content_type}
+        )
+        return f"{STORED_IMAGE_PREFIX}{file_id}"
+
+    @staticmethod
+    async def load_image(image_ref: str) -> Tuple[bytes, str]:
+        """Load image bytes and content type by gridfs:// URI or file id"""
+        if ImageService.is_stored_image(image_ref):
+            image_ref = image_ref[len(STORED_IMAGE_PREFIX):]
+
+        bucket = MongoDB.get_gridfs_bucket(IMAGE_BUCKET)
+        grid_out = await bucket.open_download_stream(ObjectId(image_ref))
+        image_bytes = await grid_out.read()
+        content_type = (grid_out.metadata or {}).get("contentType", "image/jpeg")
+        return image_bytes, content_type
+
+    @staticmethod
+    async def delete_images(image_refs: List[str]):
+        """Delete stored images by gridfs:// URI, ignoring ones already gone"""
+        bucket = MongoDB.get_gridfs_bucket(IMAGE_BUCKET)
+        for image_ref in image_refs:
+            ImageService._forget_data_url(image_ref)
+            try:
+                await bucket.delete(ObjectId(image_ref[len(STORED_IMAGE_PREFIX):]))
+            except Exception:
+                pass
+
+    @staticmethod
+    async def resolve_stored_images(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Replace gridfs:// image URIs in user messages with data URLs for the AI API
+        Only user images are sent to the model, so assistant images are left alone.
+        An image stays in the window for many turns, so its data URL is cached
+        instead of being downloaded and base64-encoded again on every turn.
+        Returns new message dicts; the inputs are not modified.
+        """
+        targets = [
+            (msg_index, item_index, item["image_url"])
+            for msg_index, msg in enumerate(messages) if msg.get("role") == "user"
+            for item_index, item in enumerate(msg.get("content", []))
+            if item.get("type") == "image" and ImageService.is_stored_image(item.get("image_url"))
+        ]
+        if not targets:
+            return messages
+
+        data_urls = await asyncio.gather(
+            *(ImageService._load_data_url(image_url) for _, _, image_url in targets),
+            return_exceptions=True
+        )
+
+        resolved = list(messages)
+        for (msg_index, item_index, _), data_url in zip(targets, data_urls):
+            if isinstance(data_url, Exception):
+                continue  # Missing image: format_conversation_history skips the URI
+
+            if resolved[msg_index] is messages[msg_index]:
+                resolved[msg_index] = {**messages[msg_index], "content": list(messages[msg_index]["content"])}
+            content = resolved[msg_index]["content"]
+            content[item_index] = {**content[item_index], "image_url": data_url}
+
+        return resolved
+
+    @staticmethod
+    async def _load_data_url(image_ref: str) -> str:
+        """Data URL of a stored image, from the cache or GridFS"""
+        global _data_url_cache_bytes
+
+        data_url = _data_url_cache.get(image_ref)
+        if data_url is not None:
+            _data_url_cache.move_to_end(image_ref)
+            return data_url
+
+        image_bytes, content_type = await ImageService.load_image(image_ref)
+        data_url = f"data:{content_type};base64,{pybase64.b64encode(image_bytes).decode('ascii')}"
+
+        if image_ref not in _data_url_cache and len(data_url) <= MAX_DATA_URL_CACHE_BYTES:
+            _data_url_cache[image_ref] = data_url
+            _data_url_cache_bytes += len(data_url)
+            while _data_url_cache_bytes > MAX_DATA_URL_CACHE_BYTES:
+                _, evicted = _data_url_cache.popitem(last=False)
+                _data_url_cache_bytes -= len(evicted)
+        return data_url
+
+    @staticmethod
+    def _forget_data_url(image_ref: str):
+        """Drop a deleted image's cached data URL"""
+        global _data_url_cache_bytes
+
+        data_url = _data_url_cache.pop(image_ref, None)
+        if data_url is not None:
+            _data_url_cache_bytes -= len(data_url)
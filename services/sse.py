@@ -0,0 +1,115 @@
+"""
+Server-Sent Events framing
+Events are built directly as bytes so StreamingResponse sends them without re-encoding
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Optional
+
+import orjson
+
+_EVENT_PREFIX = b"data: "
+_EVENT_SUFFIX = b"\n\n"
+
+# Token events only vary in the text, so the surrounding JSON is precomputed
+_CHUNK_PREFIX = b'data: {"chunk":'
+_CHUNK_SUFFIX = b"}\n\n"
+
+# Small events are coalesced into one write until either limit is reached
+BATCH_MAX_BYTES = 4096
+BATCH_MAX_DELAY = 0.02  # Seconds
+
+# SSE comment sent on idle streams so proxies don't time out a slow first token
+KEEPALIVE = b": keepalive\n\n"
+KEEPALIVE_INTERVAL = 15.0  # Seconds
+
+
+def sse_event(data: Any) -> bytes:
+    """Frame a JSON-serializable payload as one SSE event"""
+    return _EVENT_PREFIX + orjson.dumps(data) + _EVENT_SUFFIX
+
+
+def sse_chunk(text: str) -> bytes:
+    """Frame a streamed token as {"chunk": text} without building a dict per token"""
+    return _CHUNK_PREFIX + orjson.dumps(text) + _CHUNK_SUFFIX
+
+
+async def batch_events(
+    events: AsyncIterator[bytes],
+    max_bytes: int = BATCH_MAX_BYTES,
+    max_delay: float = BATCH_MAX_DELAY,
+    keepalive_interval: Optional[float] = KEEPALIVE_INTERVAL
+) -> AsyncIterator[bytes]:
+    """
+    Coalesce framed SSE events into fewer, larger writes
+    A batch is sent once it reaches max_bytes or its first event is max_delay old,
+    even if the model is between tokens, so events are never held back for long.
+    Each event is complete before it is buffered, so clients see the same events.
+    The first event is sent on its own so time to first token is unchanged, and a
+    keepalive comment is sent whenever nothing was written for keepalive_interval.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = events.__aiter__()
+    buffer = bytearray()
+    deadline = 0.0
+    last_write = loop.time()
+    first = True
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            # Wake up to flush a due batch, or to keep an idle connection alive
+            if buffer:
+                timeout = max(deadline - loop.time(), 0)
+            elif keepalive_interval:
+                timeout = max(last_write + keepalive_interval - loop.time(), 0)
+            else:
+                timeout = None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield bytes(buffer) if buffer else KEEPALIVE
+                buffer.clear()
+                last_write = loop.time()
+                continue
+
+            try:
+                event = pending.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                if buffer:
+                    yield bytes(buffer)
+                raise
+            finally:
+                pending = None
+
+            if first:
+                first = False
+                yield event
+                last_write = loop.time()
+                continue
+
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer += event
+            if len(buffer) >= max_bytes:
+                yield bytes(buffer)
+                buffer.clear()
+                last_write = loop.time()
+
+        if buffer:
+            yield bytes(buffer)
+    finally:
+        if pending is not None:
+            # The source can't be closed while its __anext__ is still running. asyncio.wait
+            # doesn't raise for the cancelled read, so a cancellation of this task still propagates
+            pending.cancel()
+            await asyncio.wait({pending})
+            if not pending.cancelled():
+                pending.exception()  # Retrieved, so a late failure isn't logged as unhandled
+        # Close the source right away instead of leaving it to garbage collection
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,37 @@
+"""
+Request Timing Service
+Per-phase wall-clock timings, reported as Server-Timing headers and in the logs
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseTimer:
+    """Accumulates wall time per phase of a request (db, csv, llm, save, ...)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.durations: Dict[str, float] = {}  # Phase -> milliseconds
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        """Time the enclosed block, adding to earlier blocks of the same phase"""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter_ns() - start) / 1_000_000
+            self.durations[phase] = self.durations.get(phase, 0.0) + elapsed_ms
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, e.g. "db;dur=2.1, llm;dur=1800.0\""""
+        return ", ".join(f"{phase};dur={ms:.1f}" for phase, ms in self.durations.items())
+
+    def log(self):
+        """Log the timings so percentiles can be derived per endpoint"""
+        logger.info(f"{self.name} timings: {self.server_timing()}")
@@ -0,0 +1,56 @@
+"""
+Upload Service
+Reads multipart uploads into a single buffer without intermediate copies
+"""
+
+from typing import Optional
+
+from fastapi import UploadFile
+
+READ_CHUNK_SIZE = 1 << 20  # 1MB
+
+
+class UploadService:
+    """Service for reading uploaded files"""
+
+    @staticmethod
+    async def read_upload(file: UploadFile, max_size: Optional[int] = None) -> bytearray:
+        """
+        Read an upload in fixed-size chunks into one buffer
+        When the size is known the buffer is allocated once up front,
+        so it never has to grow and be copied while reading.
+        With max_size, oversized uploads raise ValueError without being read
+        (or as soon as the limit is crossed when the size isn't announced).
+        """
+        if max_size is not None and file.size is not None and file.size > max_size:
+            raise ValueError(f"Upload exceeds {max_size} bytes")
+
+        if file.size is None:
+            buffer = bytearray()
+            while chunk := await file.read(READ_CHUNK_SIZE):
+                buffer += chunk
+                if max_size is not None and len(buffer) > max_size:
+                    raise ValueError(f"Upload exceeds {max_size} bytes")
+            return buffer
+
+        buffer = bytearray(file.size)
+        view = memoryview(buffer)
+        offset = 0
+        while chunk := await file.read(READ_CHUNK_SIZE):
+            end = offset + len(chunk)
+            if max_size is not None and end > max_size:
+                view.release()
+                raise ValueError(f"Upload exceeds {max_size} bytes")
+            if end > len(buffer):
+                # More data than announced: fall back to growing the buffer
+                view.release()
+                buffer[offset:] = chunk
+                view = memoryview(buffer)
+            else:
+                view[offset:end] = chunk
+            offset = end
+        view.release()
+
+        # Trim in case the upload was shorter than announced
+        del buffer[offset:]
+        return buffer
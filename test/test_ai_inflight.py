@@ -0,0 +1,107 @@
+"""
+Test script for sharing one OpenAI call between identical concurrent requests
+Uses a stand-in OpenAI client, so no API key is needed
+"""
+import asyncio
+from types import SimpleNamespace
+from services import ai_service
+from services.ai_service import AIService
+
+
+class FakeCompletions:
+    """chat.completions stand-in that counts calls and answers after a short delay"""
+
+    def __init__(self, error: Exception = None):
+        self.calls = 0
+        self.error = error
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        if self.error:
+            raise self.error
+        message = SimpleNamespace(content=f"reply {self.calls}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def _use_completions(completions: FakeCompletions):
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    AIService.get_client = staticmethod(lambda: client)
+
+
+def _messages(text: str):
+    return [{"role": "user", "content": text}]
+
+
+async def test_concurrent_calls_share_one_request():
+    """Identical concurrent requests make one OpenAI call and get the same reply"""
+    print("Testing in-flight coalescing...")
+    print("-" * 50)
+
+    completions = FakeCompletions()
+    _use_completions(completions)
+
+    replies = await asyncio.gather(*(AIService.generate_response(_messages("same question")) for _ in range(5)))
+    assert completions.calls == 1
+    assert replies == ["reply 1"] * 5
+    assert not ai_service._in_flight
+
+    # Different requests are not merged
+    await asyncio.gather(
+        AIService.generate_response(_messages("question a")),
+        AIService.generate_response(_messages("question b"))
+    )
+    assert completions.calls == 3
+    print("5 identical requests -> 1 call, 2 different requests -> 2 calls")
+    print("\n")
+
+
+async def test_cancelled_caller_does_not_cancel_others():
+    """A caller going away leaves the shared call running for the rest"""
+    print("Testing a cancelled caller...")
+    print("-" * 50)
+
+    completions = FakeCompletions()
+    _use_completions(completions)
+
+    first = asyncio.create_task(AIService.generate_response(_messages("shared")))
+    second = asyncio.create_task(AIService.generate_response(_messages("shared")))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == "reply 1"
+    assert completions.calls == 1
+    print("The remaining caller got the shared reply")
+    print("\n")
+
+
+async def test_failure_reaches_every_caller():
+    """A failed call is reported to every joined caller and is not remembered"""
+    print("Testing failure propagation...")
+    print("-" * 50)
+
+    completions = FakeCompletions(error=RuntimeError("upstream down"))
+    _use_completions(completions)
+
+    replies = await asyncio.gather(*(AIService.generate_response(_messages("failing question")) for _ in range(3)))
+    assert completions.calls == 1
+    assert all("upstream down" in reply for reply in replies)
+    assert not ai_service._in_flight
+
+    # The failure isn't cached, so the next request calls OpenAI again
+    completions.error = None
+    assert await AIService.generate_response(_messages("failing question")) == "reply 2"
+    print("Every caller saw the error; the retry made a new call")
+    print("\n")
+
+
+async def main():
+    await test_concurrent_calls_share_one_request()
+    await test_cancelled_caller_does_not_cancel_others()
+    await test_failure_reaches_every_caller()
+    print("=" * 50)
+    print("All tests completed successfully!")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
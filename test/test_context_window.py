@@ -0,0 +1,60 @@
+"""
+Test script for the stepped sliding window
+The window start only moves in whole steps, so the prompt prefix stays cacheable between steps
+"""
+from services.context_window import ContextWindowService
+
+
+def test_stepped_window_boundaries():
+    """Window sizes at and around each step boundary"""
+    print("Testing stepped window boundaries...")
+    print("-" * 50)
+
+    size = ContextWindowService._stepped_window_size
+    slots = 18  # Step of 9
+
+    # Everything fits: keep it all
+    assert size(0, slots) == 0
+    assert size(slots, slots) == slots
+
+    # One past the window jumps a whole step, then grows back to full
+    assert size(slots + 1, slots) == slots + 1 - 9
+    assert size(slots + 9, slots) == slots
+    assert size(slots + 10, slots) == slots + 10 - 18
+
+    for count in range(slots + 1, 200):
+        kept = size(count, slots)
+        start = count - kept
+        assert slots - 9 < kept <= slots, (count, kept)
+        assert start % 9 == 0, (count, start)
+    print(f"Boundaries hold for every conversation length up to 200 with {slots} slots")
+
+    # Degenerate windows still make progress
+    assert size(5, 1) == 1
+    assert size(3, 0) == 0
+    print("\n")
+
+
+def test_prefix_stable_between_steps():
+    """Consecutive turns within a step keep the same first message"""
+    print("Testing prompt prefix stability...")
+    print("-" * 50)
+
+    messages = [{"role": "user", "content": [{"type": "text", "text": f"message {i}"}]} for i in range(60)]
+    starts = []
+    for count in range(25, 60):
+        window = ContextWindowService.apply_sliding_window(messages[:count], max_messages=20, preserve_first=2)
+        starts.append(window["messages"][2]["content"][0]["text"])
+
+    # The window has 18 sliding slots, so the start changes once every 9 turns
+    changes = sum(1 for previous, current in zip(starts, starts[1:]) if previous != current)
+    assert changes <= len(starts) // 9 + 1, changes
+    print(f"Window start changed {changes} times over {len(starts)} turns")
+    print("\n")
+
+
+if __name__ == "__main__":
+    test_stepped_window_boundaries()
+    test_prefix_stable_between_steps()
+    print("=" * 50)
+    print("All tests completed successfully!")
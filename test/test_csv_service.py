@@ -2,6 +2,9 @@
 Test script to verify CSV service fixes
 """
 import asyncio
+import io
+import bson
+import orjson
 import pandas as pd
 from services.csv_service import CSVService
 
@@ -81,5 +84,35 @@ async def test_csv_service():
     print("=" * 50)
 
 
+async def test_csv_with_dates():
+    """Uploaded CSVs with date columns and blank cells must stay serializable"""
+    print("Testing CSV upload with a date column...")
+    print("-" * 50)
+
+    csv_bytes = (
+        b"day,joined_at,amount\n"
+        b"2024-01-01,2024-01-01 09:30:00,10\n"
+        b",,20\n"
+        b"2024-01-03,2024-01-03 18:00:00,\n"
+    )
+    df = await CSVService().parse_csv_bytes(csv_bytes)
+    print(df.dtypes)
+
+    # Same values as pandas' C engine: dates stay as their source text, blanks as NaN
+    c_engine = pd.read_csv(io.BytesIO(csv_bytes), engine="c")
+    assert df.equals(c_engine), (df, c_engine)
+    assert df["day"][0] == "2024-01-01" and df["joined_at"][0] == "2024-01-01 09:30:00"
+    assert pd.isna(df["day"][1]) and pd.isna(df["joined_at"][1])
+
+    records = df.to_dict("records")
+
+    # Both encoders used when storing and streaming messages must accept the rows
+    orjson.dumps(records)
+    bson.encode({"rows": records})
+    print(f"Serialized {len(records)} rows: {records}")
+    print("\n")
+
+
 if __name__ == "__main__":
     asyncio.run(test_csv_service())
+    asyncio.run(test_csv_with_dates())
@@ -0,0 +1,98 @@
+"""
+Test script for the in-process session read cache and its write invalidation
+Runs against an in-memory stand-in for the conversations collection, no MongoDB needed
+"""
+import asyncio
+from bson import ObjectId
+from database import MongoDB
+from services import chat_service
+from services.chat_service import ChatService
+
+
+class FakeConversations:
+    """Answers the session aggregate with the current messages, optionally pausing mid-read"""
+
+    def __init__(self, conversation_id: str):
+        self.conversation_id = conversation_id
+        self.messages = [{"_id": ObjectId(), "role": "user", "text": "hello"}]
+        self.reads = 0
+        self.read_started = asyncio.Event()
+        self.release_read = None
+
+    def aggregate(self, pipeline):
+        return self
+
+    async def to_list(self, length=None):
+        self.reads += 1
+        # Snapshot first, like a query that has already read the data it returns
+        messages = [dict(msg) for msg in self.messages]
+        self.read_started.set()
+        if self.release_read is not None:
+            await self.release_read.wait()
+        return [{"_id": ObjectId(self.conversation_id), "title": "Test", "messages": messages}]
+
+
+def _use_collection(collection):
+    MongoDB.get_collection = classmethod(lambda cls, name: collection)
+
+
+async def test_reads_are_cached_until_a_write():
+    """Repeated reads hit the cache; a write evicts it"""
+    print("Testing cache hits and invalidation...")
+    print("-" * 50)
+
+    conversation_id = str(ObjectId())
+    collection = FakeConversations(conversation_id)
+    _use_collection(collection)
+
+    first = await ChatService.get_conversation_with_messages(conversation_id)
+    second = await ChatService.get_conversation_with_messages(conversation_id)
+    assert second is first and collection.reads == 1
+
+    collection.messages.append({"_id": ObjectId(), "role": "assistant", "text": "hi"})
+    ChatService._invalidate_session(conversation_id)
+    third = await ChatService.get_conversation_with_messages(conversation_id)
+    assert collection.reads == 2 and len(third["messages"]) == 2
+    print(f"{collection.reads} reads for 3 calls, fresh result after the write")
+    print("\n")
+
+
+async def test_write_during_read():
+    """A read that overlapped a write returns its result but doesn't cache it"""
+    print("Testing a write landing during a read...")
+    print("-" * 50)
+
+    conversation_id = str(ObjectId())
+    collection = FakeConversations(conversation_id)
+    collection.release_read = asyncio.Event()
+    _use_collection(collection)
+
+    read = asyncio.create_task(ChatService.get_conversation_with_messages(conversation_id))
+    await collection.read_started.wait()
+
+    # The write lands after the read took its snapshot but before it finished
+    collection.messages.append({"_id": ObjectId(), "role": "assistant", "text": "hi"})
+    ChatService._invalidate_session(conversation_id)
+    collection.release_read.set()
+    stale = await read
+    assert len(stale["messages"]) == 1
+
+    collection.release_read = None
+    fresh = await ChatService.get_conversation_with_messages(conversation_id)
+    assert collection.reads == 2 and len(fresh["messages"]) == 2
+
+    # Write tracking only lives while reads are in progress
+    assert conversation_id not in chat_service._session_reads
+    print("Stale read was not cached; the next read saw the write")
+    print("\n")
+
+
+async def main():
+    await test_reads_are_cached_until_a_write()
+    await test_write_during_read()
+    print("=" * 50)
+    print("All tests completed successfully!")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""
+Test script for keyset paging of session messages
+Needs the MongoDB from .env; the test conversation is deleted afterwards
+"""
+import asyncio
+from datetime import timedelta
+from database import MongoDB
+from models import MessageRole, utc_now
+from services.chat_service import ChatService
+
+
+async def _page_back(conversation_id: str, limit: int, use_id: bool):
+    """Walk a conversation back from its newest `limit` messages, returning message ids oldest first"""
+    everything = await ChatService.get_conversation_with_messages(conversation_id, limit=0)
+    page = everything["messages"][-limit:]
+    ids = []
+
+    while page:
+        ids = [msg["id"] for msg in page] + ids
+        oldest = page[0]
+        older = await ChatService.get_conversation_with_messages(
+            conversation_id,
+            limit=limit,
+            before=oldest["timestamp"],
+            before_id=oldest["_id"] if use_id else None
+        )
+        page = older["messages"]
+
+    return ids
+
+
+async def test_page_boundary_on_a_tie():
+    """Messages sharing a timestamp across a page boundary are neither skipped nor repeated"""
+    print("Testing keyset paging across tied timestamps...")
+    print("-" * 50)
+
+    conversation = await ChatService.create_conversation("Paging test")
+    conversation_id = conversation["id"]
+    try:
+        # Seven messages, the middle five sharing one timestamp (their ids still increase)
+        start = utc_now().replace(microsecond=0)
+        messages = []
+        for i, second in enumerate((0, 1, 1, 1, 1, 1, 2)):
+            message = ChatService.build_message(conversation_id, MessageRole.USER, [{"type": "text", "text": f"m{i}"}])
+            message["timestamp"] = start + timedelta(seconds=second)
+            messages.append(message)
+        await ChatService.add_messages_bulk(conversation_id, messages)
+        expected = [message["id"] for message in messages]
+
+        # Pages of 2 put boundaries inside the tied run
+        paged = await _page_back(conversation_id, limit=2, use_id=True)
+        print(f"Expected: {expected}")
+        print(f"Paged:    {paged}")
+        assert paged == expected
+
+        # The timestamp alone can't split a tie: everything tied with a boundary is skipped
+        timestamp_only = await _page_back(conversation_id, limit=2, use_id=False)
+        assert len(timestamp_only) < len(expected)
+        print(f"Timestamp-only cursor returned {len(timestamp_only)}/{len(expected)} messages")
+    finally:
+        await ChatService.delete_conversation(conversation_id)
+    print("\n")
+
+
+async def main():
+    await MongoDB.connect()
+    try:
+        await test_page_boundary_on_a_tie()
+    finally:
+        await MongoDB.close()
+    print("=" * 50)
+    print("All tests completed successfully!")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+"""
+Test script for SSE event batching: coalescing, keepalives and early close
+"""
+import asyncio
+from services.sse import KEEPALIVE, batch_events, sse_chunk
+
+
+async def _events(chunks, delay=0.0):
+    """Yield framed chunk events, optionally pausing before each one"""
+    for text in chunks:
+        if delay:
+            await asyncio.sleep(delay)
+        yield sse_chunk(text)
+
+
+async def test_coalescing():
+    """The first event goes out alone; the rest are joined up to max_bytes"""
+    print("Testing event coalescing...")
+    print("-" * 50)
+
+    chunks = [f"token{i}" for i in range(20)]
+    writes = [w async for w in batch_events(_events(chunks), max_bytes=64, max_delay=1.0)]
+
+    assert writes[0] == sse_chunk(chunks[0])
+    assert b"".join(writes) == b"".join(sse_chunk(text) for text in chunks)
+    assert len(writes) < len(chunks)
+    # Every write except the last ends on an event boundary and stops right after crossing max_bytes
+    for write in writes[1:-1]:
+        assert write.endswith(b"\n\n") and len(write) >= 64
+    print(f"{len(chunks)} events sent in {len(writes)} writes")
+    print("\n")
+
+
+async def test_max_delay_flush():
+    """A partial batch is flushed once its first event is max_delay old"""
+    print("Testing max_delay flush...")
+    print("-" * 50)
+
+    writes = [w async for w in batch_events(_events(["a", "b", "c"], delay=0.05), max_delay=0.01)]
+
+    # Events arrive slower than max_delay, so none of them are held for the next one
+    assert writes == [sse_chunk("a"), sse_chunk("b"), sse_chunk("c")]
+    print(f"Writes: {writes}")
+    print("\n")
+
+
+async def test_keepalive():
+    """An idle stream gets keepalive comments until the first event arrives"""
+    print("Testing keepalive on an idle stream...")
+    print("-" * 50)
+
+    async def slow_first_token():
+        await asyncio.sleep(0.12)
+        yield sse_chunk("late")
+
+    writes = [w async for w in batch_events(slow_first_token(), keepalive_interval=0.05)]
+
+    assert writes[-1] == sse_chunk("late")
+    assert writes[:-1] and all(w == KEEPALIVE for w in writes[:-1])
+    print(f"{len(writes) - 1} keepalives before the first event")
+    print("\n")
+
+
+async def test_early_close():
+    """Closing the batcher mid-read cancels the pending read and closes the source"""
+    print("Testing early close...")
+    print("-" * 50)
+
+    closed = asyncio.Event()
+
+    async def endless():
+        try:
+            yield sse_chunk("first")
+            while True:
+                await asyncio.sleep(10)
+                yield sse_chunk("never")
+        finally:
+            closed.set()
+
+    batcher = batch_events(endless(), keepalive_interval=0.01)
+    assert await batcher.__anext__() == sse_chunk("first")
+    # The next write is a keepalive, sent while the source's __anext__ is still running
+    assert await batcher.__anext__() == KEEPALIVE
+    await batcher.aclose()
+
+    assert closed.is_set()
+    print("Source closed without errors")
+    print("\n")
+
+
+async def test_cancel_during_close():
+    """Cancelling the consumer while the batcher waits for the source is not swallowed"""
+    print("Testing cancellation during close...")
+    print("-" * 50)
+
+    async def slow_to_stop():
+        yield sse_chunk("first")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            # Takes a while to wind down after its read is cancelled
+            await asyncio.sleep(0.2)
+            raise
+        yield sse_chunk("never")
+
+    async def consume():
+        batcher = batch_events(slow_to_stop(), keepalive_interval=0.01)
+        assert await batcher.__anext__() == sse_chunk("first")
+        assert await batcher.__anext__() == KEEPALIVE
+        await batcher.aclose()
+
+    task = asyncio.create_task(consume())
+    await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    assert task.cancelled()
+    print("Consumer ended cancelled")
+    print("\n")
+
+
+async def main():
+    await test_coalescing()
+    await test_max_delay_flush()
+    await test_keepalive()
+    await test_early_close()
+    await test_cancel_during_close()
+    print("=" * 50)
+    print("All tests completed successfully!")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())